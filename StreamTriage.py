@@ -1,11 +1,20 @@
+import os
 import resource
 from statistics import median
 import matplotlib.pyplot as plt
 import streamlit as st
-from triage_model import G, Patient, Process, gggauge, patch_resource, get_monitor
+from triage_model import G, Patient, Process, gggauge, patch_resource, get_monitor, get_scenario
+from triage_surrogate import WhatIf
+from triage_sketch import KLL
+from triage_analytic import preview
+from triage_service import run_remote
+from triage_cli import summarize
 import pandas as pd
 from plotnine import *
 
+SURROGATE_PATH = "surrogate.json"
+SERVICE = os.environ.get("TRIAGE_SERVICE") # host:port of triage_service.py, shared by all sessions
+
 st.title("Simply Simpy!")
 
 st.header("Simulation for Production Planning and Process Improvement")
@@ -29,6 +38,43 @@ with st.sidebar.container():
     G.resource_capacity["doctorOPD"] = st.sidebar.number_input("How many doctors - OPD?", min_value=1, value=1)
     G.resource_capacity["doctorER"] = st.sidebar.number_input("How many doctors - ER?", min_value=1, value=2)
 
+st.subheader("What-If: Instant Estimate")
+
+@st.cache_resource
+def get_what_if():
+    """
+    One surrogate per server, shared by sessions and kept warm across reruns.
+    With a service, its fallback simulations run there too.
+    """
+    runner = (lambda scenario, number_runs: run_remote(SERVICE, scenario, number_runs)) if SERVICE else None
+    if os.path.exists(SURROGATE_PATH):
+        return WhatIf.load(SURROGATE_PATH, runner=runner)
+    return WhatIf(runner=runner)
+
+def show_answer(answer):
+    st.caption("Source: {}".format(answer["source"]))
+    st.dataframe(pd.DataFrame({"Estimate": answer["kpi"], "Std. dev.": answer["std"] or {}}))
+
+what_if = get_what_if()
+what_if_scenario = get_scenario()
+what_if_box = st.container()
+answer = what_if.lookup(what_if_scenario)
+if answer:
+    with what_if_box:
+        show_answer(answer)
+else: # filled in from the multi-run results below, rather than simulating twice
+    with what_if_box:
+        st.caption("No confident estimate yet: learning from the multiple runs below.")
+
+st.subheader("Analytic Preview (Erlang C)")
+
+analytic = preview()
+st.caption("Steady-state M/M/c per step, minutes. TAT (ER path): {:.1f}, TAT (OPD path): {:.1f}".format(
+    analytic["TAT"], analytic["TAT_OPD"]))
+st.dataframe(pd.DataFrame(analytic["steps"]).T)
+if not analytic["stable"]:
+    st.warning("Some step is at rho >= 1: queues grow for as long as the clinic stays open.")
+
 st.subheader("Single Run: Summary")
 
 p = Process()
@@ -85,11 +131,31 @@ sim_runs = st.sidebar.slider("How many runs?", 30, 100)
 
 st.subheader("Multiple Runs: Performance Indicators")
 
-sim_results = []
-for i in range(0, sim_runs):
-    p = Process()
-    p.monitor_capacity()
-    sim_results.append(p.run_once())
+if SERVICE:
+    sim_job = run_remote(SERVICE, get_scenario(), sim_runs)
+    if sim_job.get("skipped"):
+        st.warning("The service skipped this scenario as {}: it was not simulated.".format(sim_job["skipped"]))
+        st.stop()
+    # The service sends KPIs no patient reached as null; NaN as in local runs
+    sim_results = [{kpi: {key: float("nan") if value is None else value for key, value in values.items()}
+                    for kpi, values in run_result.items()} for run_result in sim_job["runs"]]
+    sim_quantiles = sim_job["quantiles"]
+else:
+    sim_results = []
+    sim_sketches = {}
+    for i in range(0, sim_runs):
+        p = Process()
+        p.monitor_capacity()
+        sim_results.append(p.run_once())
+        for key, sketch in G.sketches.items():
+            sim_sketches.setdefault(key, KLL()).merge(sketch)
+    sim_quantiles = {key: sketch.quantiles() for key, sketch in sim_sketches.items()}
+
+if not answer:
+    what_if.learn(what_if_scenario, summarize(sim_results))
+    what_if.save(SURROGATE_PATH)
+    with what_if_box:
+        show_answer(what_if.query(what_if_scenario, simulate=False))
 
 Capacity_Utilization = {}
 ggg_plots = []
@@ -106,6 +172,9 @@ with st.container():
 
 st.markdown("""___""")
 
+st.write("Percentiles over all patients in all runs")
+st.dataframe(pd.DataFrame(sim_quantiles).T)
+
 Queued = {}
 for resource_type in G.resource_types:
     Queued[resource_type] = [sim_result["Queued"][resource_type] for sim_result in sim_results]
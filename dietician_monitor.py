@@ -1,7 +1,7 @@
 import resource
 import simpy
 import random
-from numpy import median, trapz
+from numpy import median, trapz, arange, asarray, searchsorted, where
 from functools import partial, wraps
 
 def patch_resource(resource, pre=None, post=None):
@@ -66,6 +66,24 @@ def help_monitor(resource_name, ts):
         item[1] += 1; item[2] -= 1 
         G.resource_monitor.get(resource_name).append(tuple(item))
 
+def resample_monitor(data, grid):
+    """
+    Poll the data logged by the monkey-patched resource after the fact.
+    Each point of the time grid takes the last (timestamp, count, queue)
+    logged at or before it, or zeros before the first event, which is what
+    a polling process would have seen, without any polling events.
+    """
+    grid = asarray(grid, dtype=float)
+    if not data:
+        return [(t, 0, 0) for t in grid.tolist()]
+    ts, counts, queues = (asarray(column) for column in zip(*data))
+    idx = searchsorted(ts, grid, side='right') - 1
+    logged = idx >= 0
+    idx = where(logged, idx, 0)
+    return list(zip(grid.tolist(),
+                    where(logged, counts[idx], 0).tolist(),
+                    where(logged, queues[idx], 0).tolist()))
+
 class G:
     # Simulation settings
     number_of_runs = 30
@@ -84,7 +102,8 @@ class G:
     lead = []
 
     # Monitoring
-    resource_utilization = {}  # Data from genertor for process monitoring 
+    resource_utilization = {}  # Data from monkey-patching resampled every poll_step after the run
+    poll_step = 0.25
     resource_monitor = {}      # Data from monkey-patching some of a resource's methods 
 
     def clear_accumulators():
@@ -104,6 +123,7 @@ class Consultation:
         self.env = simpy.Environment()
         self.dietician = simpy.Resource(self.env, 1)
         self.patient_counter = 0
+        self.monitored = False # Resources patched to log to G.resource_monitor
 
     def monitor_resource(self):
         """
@@ -111,6 +131,9 @@ class Consultation:
         Gets the callback with 'get_monitor()' 
         and executes monkey-patching resource with 'patch_resource()`
         """
+        if self.monitored: # patching twice would log every change twice
+            return
+        self.monitored = True
         resource_names=['dietician']
         for name in resource_names:
             if hasattr(self, name):
@@ -158,6 +181,7 @@ class Consultation:
             
     def run_once(self, proc_monitor=False):
         G.clear_accumulators() # Clear history
+        self.monitor_resource() # utilization comes from this run's change points, not an earlier run's
 
         run_averages = {
             "queued": None,
@@ -166,9 +190,9 @@ class Consultation:
         }
         
         self.env.process(self.generate_patient())
-        if proc_monitor:
-            self.env.process(self.monitor_process(['dietician']))
         self.env.run(until=G.simulation_horizon)
+        if proc_monitor:
+            self.monitor_process(['dietician'])
 
         run_averages["queued"] = sum(G.queued) / len(G.queued) if len(G.queued) > 0 else None
         run_averages["lead"] = sum(G.lead) / len(G.lead) if len(G.lead) > 0 else None
@@ -182,18 +206,14 @@ class Consultation:
 
     def monitor_process(self, resource_names):
         """
-        Generator for monitoring process that shares the environment with the main process
-        and collects information.
+        Polled view of the resources at regular time intervals, rebuilt after
+        the run from the data of the monkey-patched resources (monitor_resource()).
+        Used to be a polling process in the shared environment; resampling the
+        change points gives the same series without thousands of extra events.
         """
-        resources = []
+        if not self.monitored:
+            raise RuntimeError("monitor_process needs the change-point log; call monitor_resource() before the run")
+        grid = arange(0, self.env.now, G.poll_step)
         for name in resource_names:
             if hasattr(self, name) and isinstance(getattr(self, name), simpy.resources.resource.Resource):
-                G.resource_utilization[name] = []
-                resources.append((name, getattr(self, name)))
-        while True:
-            for rname, r in resources:
-                item = (self.env.now,
-                        r.count,
-                        len(r.queue))
-                G.resource_utilization.get(rname).append(item)
-            yield self.env.timeout(0.25)    
+                G.resource_utilization[name] = resample_monitor(G.resource_monitor.get(name, []), grid)
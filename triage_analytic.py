@@ -0,0 +1,95 @@
+'''
+Analytic preview of the triage network, no replications needed.
+Each step is an M/M/c queue: Poisson arrivals, exponential service, c servers.
+Departures from a stable M/M/c queue are again Poisson (Burke's theorem),
+so the registration -> triage -> OPD (share_OPD) / ER chain is a Jackson network.
+Each step can then be solved on its own with the Erlang C formula, using the
+same G parameters the simulation uses.
+
+Steady-state figures are a sanity check, not a forecast: the simulation starts
+empty and stops at the horizon, so a run at rho >= 1 still returns finite
+waits, and waits near rho = 1 take longer than a clinic day to build up.
+
+Usage:
+    preview()                                     # parameters in G
+    preview({"resource_capacity": {"doctorER": 3}})
+    screen(scenario, max_wait=15)                 # "infeasible", "overstaffed" or None
+'''
+
+from math import inf
+
+from triage_model import is_unstable, step_rates
+
+def erlang_c(servers, offered):
+    """
+    Probability that an arrival waits in an M/M/c queue with c servers and
+    offered load a = arrival rate x mean service time (in Erlangs).
+    Via the Erlang B recursion, which is stable for large c.
+    """
+    if offered >= servers:
+        return 1.0
+    b = 1.0
+    for k in range(1, servers + 1):
+        b = offered * b / (k + offered * b)
+    rho = offered / servers
+    return b / (1 - rho * (1 - b))
+
+def mmc(arrival_rate, mean_service, servers):
+    """
+    Steady-state M/M/c figures: utilization rho, probability of waiting,
+    mean wait in queue Wq, mean queue length Lq and mean time in step W.
+    Wq, Lq and W are inf when rho >= 1.
+    """
+    offered = arrival_rate * mean_service
+    rho = offered / servers
+    p_wait = erlang_c(servers, offered)
+    if rho >= 1:
+        wait = inf
+    else:
+        wait = p_wait / (servers / mean_service - arrival_rate)
+    return {"rho": rho, "p_wait": p_wait, "Wq": wait, "Lq": arrival_rate * wait, "W": wait + mean_service}
+
+def preview(scenario=None):
+    """
+    Per step M/M/c figures and the mean lead time through each path.
+    TAT is the ER path, as TAT in the simulation; TAT_OPD the outpatient path.
+    """
+    steps = {resource_type: mmc(*rates) for resource_type, rates in step_rates(scenario).items()}
+    front = steps["receptionist"]["W"] + steps["nurse"]["W"]
+    return {
+        "steps": steps,
+        "TAT": front + steps["doctorER"]["W"],
+        "TAT_OPD": front + steps["doctorOPD"]["W"],
+        "stable": all(step["rho"] < 1 for step in steps.values())
+    }
+
+def screen(scenario=None, max_wait=None):
+    """
+    Quick verdict on a scenario before simulating it:
+    - "infeasible": rho >= 1 at some step, queues grow without bound, as
+      triage_model.is_unstable decides for screen_unstable
+    - "overstaffed": some step would still keep its mean wait within max_wait
+      with one server fewer (only checked when max_wait is given)
+    - None: worth simulating
+    """
+    if is_unstable(scenario):
+        return "infeasible"
+    if max_wait is not None:
+        for arrival_rate, mean_service, servers in step_rates(scenario).values():
+            if servers > 1 and mmc(arrival_rate, mean_service, servers - 1)["Wq"] <= max_wait:
+                return "overstaffed"
+    return None
+
+def flatten_preview(result):
+    """
+    Preview as {"Queued": {step: Wq}, "Delta": {"TAT": ...}, "Utilization": {step: rho}},
+    the shape of a run result, to set next to simulated KPIs. Unbounded
+    waits are None, i.e. null in JSON, which has no infinity.
+    """
+    def finite(value):
+        return None if value == inf else value
+    return {
+        "Queued": {resource_type: finite(step["Wq"]) for resource_type, step in result["steps"].items()},
+        "Delta": {"TAT": finite(result["TAT"])},
+        "Utilization": {resource_type: step["rho"] for resource_type, step in result["steps"].items()}
+    }
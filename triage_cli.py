@@ -0,0 +1,239 @@
+'''
+Run triage scenarios headless, without Streamlit or plotting packages.
+Scenarios come from a JSON or YAML config; KPI results go to JSON or CSV.
+
+Config layout (JSON shown, YAML is the same structure):
+{
+    "number_runs": 30,
+    "seed": 42,
+    "mean_IAT": 8,
+    "scenarios": [
+        {"name": "baseline"},
+        {"name": "extra ER doctor", "resource_capacity": {"doctorER": 3}}
+    ]
+}
+Model parameters at top level apply to every scenario, unless a scenario
+overrides them. A config without "scenarios" is a single scenario.
+For sweeps into overload, set "screen_unstable": true to skip scenarios with
+offered load rho >= 1 without simulating them, reported as "skipped", and/or
+"max_queue": 500 to stop runs whose queues blow up, flagged in the Status KPIs.
+Every result also carries an analytic Erlang C preview (see triage_analytic.py);
+--analytic-screen skips scenarios it finds infeasible, or with --max-wait overstaffed.
+JSON output is strict: KPIs no run could measure are null, not NaN.
+
+Usage: python triage_cli.py config.json --jobs 4 --output results.json
+See triage_distributed.py to run on several machines with --broker.
+'''
+
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from math import isfinite, isnan
+from statistics import median
+
+from triage_model import G, SCENARIO_KEYS, resolve_scenario, run_sketched
+from triage_sketch import KLL
+from triage_analytic import flatten_preview, preview, screen
+
+CONFIG_KEYS = ["number_runs", "seed", "scenarios"]
+
+def load_config(path):
+    """
+    Read a JSON or YAML config, chosen by file extension.
+    PyYAML is only needed, and only imported, for YAML configs.
+    """
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            import yaml
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def get_scenarios(config):
+    """
+    Expand a config into a list of scenario dicts, merging the top-level
+    model parameters under each scenario's own.
+    Raises ValueError on unknown top-level keys, e.g. a misspelt parameter.
+    """
+    unknown = set(config) - set(SCENARIO_KEYS) - set(CONFIG_KEYS)
+    if unknown:
+        raise ValueError("Unknown config keys: {}".format(", ".join(sorted(unknown))))
+    base = {key: config[key] for key in SCENARIO_KEYS if key in config}
+    scenarios = []
+    for i, entry in enumerate(config.get("scenarios", [{}])):
+        scenario = dict(base, **entry)
+        scenario["resource_capacity"] = dict(base.get("resource_capacity", {}), **entry.get("resource_capacity", {}))
+        scenario.setdefault("name", "scenario{}".format(i))
+        scenarios.append(scenario)
+    return scenarios
+
+def summarize(run_results):
+    """
+    Median across runs of each per-run KPI, as on the dashboard.
+    NaN values, e.g. a step no patient reached in a run, are left out;
+    a KPI that is NaN in every run stays NaN.
+    """
+    summary = {}
+    for kpi in run_results[0].keys():
+        summary[kpi] = {}
+        for key in run_results[0][kpi].keys():
+            values = [run_result[kpi][key] for run_result in run_results if not isnan(run_result[kpi][key])]
+            summary[kpi][key] = float(median(values)) if values else float("nan")
+    return summary
+
+def run_scenarios(scenarios, number_runs, seed=None, jobs=1, broker=None, analytic_screen=False, max_wait=None):
+    """
+    Run every scenario for number_runs replications, on a process pool
+    when jobs > 1, or on the workers of a broker at "host:port".
+    Each result carries the analytic M/M/c preview next to the simulated KPIs.
+    Scenarios get_verdict skips are reported with the reason under "skipped"
+    and not simulated.
+    """
+    verdicts = [get_verdict(scenario, analytic_screen, max_wait) for scenario in scenarios]
+    if any(verdicts):
+        feasible = [scenario for scenario, verdict in zip(scenarios, verdicts) if verdict is None]
+        simulated = run_scenarios(feasible, number_runs, seed, jobs, broker) if feasible else []
+        return [simulated.pop(0) if verdict is None else get_skipped_result(scenario, verdict)
+                for scenario, verdict in zip(scenarios, verdicts)]
+
+    tasks = get_tasks(scenarios, number_runs, seed)
+    if broker:
+        from triage_distributed import connect, parse_address, run_distributed
+        run_results = run_distributed(tasks, connect(parse_address(broker)))
+    elif jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            run_results = list(pool.map(run_sketched, *zip(*tasks)))
+    else:
+        run_results = [run_sketched(*task) for task in tasks]
+    return collect_results(scenarios, number_runs, run_results)
+
+def get_verdict(scenario, analytic_screen=False, max_wait=None):
+    """
+    Why a scenario is not worth simulating, or None: the verdict of the
+    analytic screen, or "infeasible" when the scenario sets screen_unstable
+    and its runs would all be skipped anyway.
+    """
+    if analytic_screen:
+        return screen(scenario, max_wait)
+    if resolve_scenario(scenario)["screen_unstable"]:
+        return screen(scenario)
+    return None
+
+def get_skipped_result(scenario, verdict):
+    """
+    Result of a scenario that was not simulated: no runs or KPIs, only the
+    verdict under "skipped" and the analytic preview.
+    """
+    return {"name": scenario["name"], "scenario": scenario, "number_runs": 0, "skipped": verdict,
+            "kpi": {}, "quantiles": {}, "analytic": flatten_preview(preview(scenario)), "runs": []}
+
+def strict_json(value):
+    """
+    Copy of value fit for strict JSON, which has no NaN or infinity:
+    such floats, e.g. a KPI no run could measure, become None (null).
+    """
+    if isinstance(value, dict):
+        return {key: strict_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [strict_json(item) for item in value]
+    if isinstance(value, float) and not isfinite(value):
+        return None
+    return value
+
+def get_tasks(scenarios, number_runs, seed=None):
+    """
+    (scenario, seed) for every replication, scenario by scenario.
+    Replication i of each scenario uses seed + i.
+    """
+    return [(scenario, None if seed is None else seed + i)
+            for scenario in scenarios for i in range(number_runs)]
+
+def merge_sketches(run_sketches):
+    """
+    Merge per-run sketches key by key and read off p50/p90/p99 over all
+    patients of all runs, rather than medians of per-run medians.
+    """
+    merged = {}
+    for sketches in run_sketches:
+        for key, sketch in sketches.items():
+            merged.setdefault(key, KLL()).merge(sketch)
+    return {key: sketch.quantiles() for key, sketch in merged.items()}
+
+def collect_results(scenarios, number_runs, run_results):
+    """
+    Group (run result, sketches) pairs, ordered as get_tasks, by scenario and summarize each.
+    """
+    results = []
+    for n, scenario in enumerate(scenarios):
+        scenario_results, scenario_sketches = zip(*run_results[n * number_runs:(n + 1) * number_runs])
+        results.append({
+            "name": scenario["name"],
+            "scenario": scenario,
+            "number_runs": number_runs,
+            "kpi": summarize(scenario_results),
+            "quantiles": merge_sketches(scenario_sketches),
+            "analytic": flatten_preview(preview(scenario)),
+            "runs": [{kpi: {key: float(value) for key, value in values.items()}
+                      for kpi, values in run_result.items()}
+                     for run_result in scenario_results]
+        })
+    return results
+
+def write_results(results, path):
+    """
+    Write results as JSON, or as CSV with one row per run if the path ends in .csv.
+    """
+    if path.lower().endswith('.csv'):
+        rows = []
+        for result in results:
+            if "skipped" in result:
+                rows.append({"name": result["name"], "skipped": result["skipped"]})
+            for i, run_result in enumerate(result["runs"]):
+                row = {"name": result["name"], "run": i}
+                for kpi, values in run_result.items():
+                    for key, value in values.items():
+                        row["{}.{}".format(kpi, key)] = value
+                rows.append(row)
+        # Ordered union: Status and Acuity columns only come with some scenarios
+        fieldnames = dict.fromkeys(["name", "run"])
+        for row in rows:
+            fieldnames.update(dict.fromkeys(row))
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(fieldnames))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as f:
+            json.dump(strict_json(results), f, indent=2)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run triage scenarios headless and write KPI results.")
+    parser.add_argument("config", help="JSON or YAML scenario config")
+    parser.add_argument("--runs", type=int, help="replications per scenario (overrides config)")
+    parser.add_argument("--seed", type=int, help="base random seed (overrides config)")
+    parser.add_argument("--jobs", type=int, default=1, help="worker processes")
+    parser.add_argument("--broker", help="run on distributed workers via the broker at host:port")
+    parser.add_argument("--analytic-screen", action="store_true",
+                        help="skip scenarios that Erlang C finds infeasible (rho >= 1) or, with --max-wait, overstaffed")
+    parser.add_argument("--max-wait", type=float, help="mean wait target in minutes per step for --analytic-screen")
+    parser.add_argument("--output", help="results file, .json or .csv (default: JSON to stdout)")
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    number_runs = args.runs or config.get("number_runs", G.number_runs)
+    seed = args.seed if args.seed is not None else config.get("seed")
+    results = run_scenarios(get_scenarios(config), number_runs, seed=seed, jobs=args.jobs, broker=args.broker,
+                            analytic_screen=args.analytic_screen, max_wait=args.max_wait)
+
+    if args.output:
+        write_results(results, args.output)
+    else:
+        keys = ("name", "number_runs", "skipped", "kpi", "quantiles", "analytic")
+        json.dump(strict_json([{key: result[key] for key in keys if key in result} for result in results]),
+                  sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
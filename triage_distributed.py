@@ -0,0 +1,356 @@
+'''
+Spread replications over several machines through a simple broker.
+The broker holds a queue of (scenario, seed) tasks. Workers pull tasks, run
+them with run_sketched in their own interpreter, i.e. with their own G, and
+push compact results back: KPIs and quantile sketches. A task is leased to
+one worker at a time; if the worker stops renewing its lease (crashed,
+killed, lost its node), the task goes back on the queue for another worker.
+
+Broker and workers talk over TCP with multiprocessing.managers, so nothing
+beyond the standard library is needed. The manager unpickles what clients
+send, so whoever holds the authkey can run code on the broker: the key comes
+from TRIAGE_BROKER_AUTHKEY, and a broker listening beyond loopback will not
+start without it. A loopback broker without one makes up a random key and
+prints it for its workers.
+
+Usage:
+    export TRIAGE_BROKER_AUTHKEY=<long random secret>                (everywhere)
+    python triage_distributed.py broker --host 0.0.0.0 --port 50000
+    python triage_distributed.py worker brokerhost:50000            (on each node)
+    python triage_cli.py config.json --broker brokerhost:50000
+
+For a single box, run_local() starts a broker and local worker processes.
+'''
+
+import argparse
+import ipaddress
+import os
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from multiprocessing import Process as WorkerProcess
+from multiprocessing.managers import BaseManager
+
+from triage_model import run_sketched
+
+def get_authkey():
+    """
+    The shared secret from TRIAGE_BROKER_AUTHKEY, as bytes, or None if unset.
+    """
+    authkey = os.environ.get("TRIAGE_BROKER_AUTHKEY")
+    return authkey.encode() if authkey else None
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+class Broker:
+    """
+    Task queue with leases and retries. Lives in the broker process; workers
+    and the coordinator call its methods through manager proxies, each from
+    its own thread, hence the lock.
+    """
+    def __init__(self, lease_timeout=30.0, max_attempts=3) -> None:
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._tasks = {}        # task_id -> (scenario, seed)
+        self._batches = {}      # task_id -> batch of the submitter, to collect by
+        self._pending = deque() # task_ids waiting for a worker
+        self._leases = {}       # task_id -> (worker_id, deadline)
+        self._attempts = {}     # task_id -> number of times handed out
+        self._done = set()
+        self._results = deque() # (task_id, result) not yet collected
+        self._failed = deque()  # (task_id, reason) not yet collected
+        self._closed = False
+
+    def submit(self, scenario, seed=None, batch=None):
+        """
+        Queue a task; its result is collected with collect(batch).
+        """
+        with self._lock:
+            task_id = uuid.uuid4().hex
+            self._tasks[task_id] = (scenario, seed)
+            self._batches[task_id] = batch
+            self._attempts[task_id] = 0
+            self._pending.append(task_id)
+            return task_id
+
+    def get_task(self, worker_id):
+        """
+        Lease the next task to a worker: (task_id, scenario, seed), or None if none is waiting.
+        """
+        with self._lock:
+            self._requeue_expired()
+            if not self._pending:
+                return None
+            task_id = self._pending.popleft()
+            self._attempts[task_id] += 1
+            self._leases[task_id] = (worker_id, time.monotonic() + self.lease_timeout)
+            return (task_id,) + self._tasks[task_id]
+
+    def heartbeat(self, worker_id):
+        """
+        Renew the leases held by a worker.
+        """
+        with self._lock:
+            deadline = time.monotonic() + self.lease_timeout
+            for task_id, (holder, _) in self._leases.items():
+                if holder == worker_id:
+                    self._leases[task_id] = (holder, deadline)
+
+    def put_result(self, worker_id, task_id, result):
+        """
+        Accept a result. A late duplicate from a worker whose lease
+        expired and whose task was re-run elsewhere is dropped.
+        """
+        with self._lock:
+            self._leases.pop(task_id, None)
+            if task_id in self._done or task_id not in self._tasks:
+                return
+            self._done.add(task_id)
+            self._results.append((task_id, result))
+
+    def put_error(self, worker_id, task_id, reason):
+        with self._lock:
+            self._leases.pop(task_id, None)
+            if task_id in self._tasks and task_id not in self._done:
+                self._retry(task_id, reason)
+
+    def collect(self, batch=None):
+        """
+        Results and failures of a batch since the last call, as two lists.
+        Those of other batches stay for their own submitters. The broker
+        forgets a task once it has been collected.
+        """
+        with self._lock:
+            self._requeue_expired()
+            results, self._results = self._take(self._results, batch)
+            failed, self._failed = self._take(self._failed, batch)
+            for task_id, _ in results + failed:
+                self._forget(task_id)
+            return results, failed
+
+    def cancel(self, batch=None):
+        """
+        Drop every task of a batch, queued, running or finished. Results
+        still coming in from workers for them are then dropped too.
+        """
+        with self._lock:
+            task_ids = [task_id for task_id, task_batch in self._batches.items() if task_batch == batch]
+            self._pending = deque(task_id for task_id in self._pending if self._batches[task_id] != batch)
+            _, self._results = self._take(self._results, batch)
+            _, self._failed = self._take(self._failed, batch)
+            for task_id in task_ids:
+                self._forget(task_id)
+
+    def _take(self, entries, batch):
+        taken, kept = [], deque()
+        for entry in entries:
+            (taken if self._batches[entry[0]] == batch else kept).append(entry)
+        return taken, kept
+
+    def close(self):
+        """
+        No more tasks: idle workers exit.
+        """
+        with self._lock:
+            self._closed = True
+
+    def is_closed(self):
+        with self._lock:
+            return self._closed
+
+    def _requeue_expired(self):
+        now = time.monotonic()
+        for task_id, (worker_id, deadline) in list(self._leases.items()):
+            if deadline < now:
+                del self._leases[task_id]
+                self._retry(task_id, "lease expired on worker {}".format(worker_id))
+
+    def _forget(self, task_id):
+        for state in (self._tasks, self._batches, self._leases, self._attempts):
+            state.pop(task_id, None)
+        self._done.discard(task_id)
+
+    def _retry(self, task_id, reason):
+        if self._attempts[task_id] < self.max_attempts:
+            self._pending.append(task_id)
+        else:
+            self._done.add(task_id)
+            self._failed.append((task_id, reason))
+
+_broker = None
+
+def _init_broker(lease_timeout, max_attempts):
+    global _broker
+    _broker = Broker(lease_timeout, max_attempts)
+
+def _get_broker():
+    return _broker
+
+class BrokerManager(BaseManager):
+    pass
+
+BrokerManager.register('get_broker', callable=_get_broker)
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return (host, int(port))
+
+def connect(address, authkey=None):
+    """
+    Proxy to the broker at (host, port), authenticated with authkey or
+    else TRIAGE_BROKER_AUTHKEY.
+    """
+    authkey = authkey or get_authkey()
+    if not authkey:
+        raise RuntimeError("Set TRIAGE_BROKER_AUTHKEY to the broker's key")
+    manager = BrokerManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_broker()
+
+def work(address, authkey=None, worker_id=None, poll_interval=0.2):
+    """
+    Worker loop: pull a task, run it, push the result; exit once the broker
+    is closed and the queue is empty, or the broker goes away.
+    The lease is renewed from a side thread while a replication runs.
+    """
+    worker_id = worker_id or "{}-{}".format(os.uname().nodename, os.getpid())
+    try:
+        broker = connect(address, authkey)
+        while True:
+            task = broker.get_task(worker_id)
+            if task is None:
+                if broker.is_closed():
+                    return
+                time.sleep(poll_interval)
+                continue
+            task_id, scenario, seed = task
+
+            running = threading.Event()
+            running.set()
+            def renew_lease():
+                lease_broker = connect(address, authkey) # proxies are not shared across threads
+                while running.is_set():
+                    lease_broker.heartbeat(worker_id)
+                    time.sleep(poll_interval)
+            renewer = threading.Thread(target=renew_lease, daemon=True)
+            renewer.start()
+            try:
+                result, sketches = run_sketched(scenario, seed)
+            except Exception as e:
+                broker.put_error(worker_id, task_id, repr(e))
+                continue
+            finally:
+                running.clear()
+                renewer.join()
+            broker.put_result(worker_id, task_id, (compact_result(result), sketches))
+    except (EOFError, ConnectionError):
+        return
+
+def compact_result(run_result):
+    """
+    Run result as plain floats, i.e. no numpy scalars on the wire.
+    """
+    return {kpi: {key: float(value) for key, value in values.items()}
+            for kpi, values in run_result.items()}
+
+def run_distributed(tasks, broker, poll_interval=0.2, on_result=None):
+    """
+    Submit (scenario, seed) tasks to a broker and wait for all (run result,
+    sketches) pairs, returned in task order. on_result(index, result) is
+    called as each result streams in. Raises RuntimeError if a task runs out of retries.
+    Results are collected by batch, so sweeps can share a broker.
+    """
+    batch = uuid.uuid4().hex
+    task_ids = [broker.submit(scenario, seed, batch) for scenario, seed in tasks]
+    index = {task_id: i for i, task_id in enumerate(task_ids)}
+    run_results = [None] * len(tasks)
+    remaining = len(tasks)
+    try:
+        while remaining:
+            results, failed = broker.collect(batch)
+            if failed:
+                raise RuntimeError("Replications failed: {}".format(
+                    "; ".join(reason for _, reason in failed)))
+            for task_id, result in results:
+                run_results[index[task_id]] = result
+                remaining -= 1
+                if on_result:
+                    on_result(index[task_id], result)
+            if remaining:
+                time.sleep(poll_interval)
+    except BaseException: # failed or interrupted: the rest of the batch is not wanted
+        broker.cancel(batch)
+        raise
+    return run_results
+
+def start_broker(address=('127.0.0.1', 0), authkey=None, lease_timeout=30.0, max_attempts=3):
+    """
+    Start a broker in a child process. Returns the manager; use manager.address
+    for workers, manager.get_broker() for a proxy and manager.shutdown() to stop.
+    Without an authkey or TRIAGE_BROKER_AUTHKEY a random key is used, and only on loopback.
+    """
+    authkey = authkey or get_authkey()
+    if not authkey:
+        if not is_loopback(address[0]):
+            raise RuntimeError("Set TRIAGE_BROKER_AUTHKEY to serve beyond loopback")
+        authkey = secrets.token_bytes(32)
+    manager = BrokerManager(address=address, authkey=authkey)
+    manager.start(_init_broker, (lease_timeout, max_attempts))
+    return manager
+
+def run_local(tasks, workers=2, lease_timeout=30.0, max_attempts=3):
+    """
+    Stand-in for a cluster: a broker and several worker processes on this machine.
+    """
+    authkey = get_authkey() or secrets.token_bytes(32)
+    manager = start_broker(authkey=authkey, lease_timeout=lease_timeout, max_attempts=max_attempts)
+    try:
+        broker = manager.get_broker()
+        procs = [WorkerProcess(target=work, args=(manager.address, authkey, "local-{}".format(i)))
+                 for i in range(workers)]
+        for proc in procs:
+            proc.start()
+        try:
+            return run_distributed(tasks, broker)
+        finally:
+            broker.close()
+            for proc in procs:
+                proc.join()
+    finally:
+        manager.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Broker and workers for distributed triage replications.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    broker_parser = commands.add_parser("broker", help="serve a task queue")
+    broker_parser.add_argument("--host", default="127.0.0.1", help="interface; beyond loopback needs TRIAGE_BROKER_AUTHKEY")
+    broker_parser.add_argument("--port", type=int, default=50000)
+    broker_parser.add_argument("--lease-timeout", type=float, default=30.0, help="seconds before an unrenewed task is re-queued")
+    broker_parser.add_argument("--max-attempts", type=int, default=3)
+    worker_parser = commands.add_parser("worker", help="pull and run tasks")
+    worker_parser.add_argument("address", help="broker host:port")
+    args = parser.parse_args(argv)
+
+    if args.command == "broker":
+        authkey = get_authkey()
+        if not authkey:
+            if not is_loopback(args.host):
+                parser.error("set TRIAGE_BROKER_AUTHKEY to serve on {}".format(args.host))
+            authkey = secrets.token_hex(16).encode()
+            print("export TRIAGE_BROKER_AUTHKEY={} for workers and --broker".format(authkey.decode()), file=sys.stderr)
+        _init_broker(args.lease_timeout, args.max_attempts)
+        manager = BrokerManager(address=(args.host, args.port), authkey=authkey)
+        manager.get_server().serve_forever()
+    else:
+        work(parse_address(args.address))
+
+if __name__ == '__main__':
+    main()
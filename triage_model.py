@@ -1,9 +1,10 @@
 import simpy
 import random
-from numpy import median, trapz, linspace, sin, cos, pi, vectorize, append, array, asarray
-from functools import partial, wraps
-from plotnine import *
-import pandas as pd
+from copy import deepcopy
+from numpy import trapz, linspace, sin, cos, pi, append, asarray, arange, searchsorted, where
+from functools import wraps
+from triage_sketch import KLL
+from triage_queue import HeapPriorityResource, HeapPreemptiveResource
 
 def patch_resource(resource, pre=None, post=None):
     """
@@ -46,11 +47,40 @@ def get_monitor(data):
 def help_monitor(resource_name, ts):
     if (resource_name in G.utilization_event) \
         and (G.utilization_event.get(resource_name)[-1][0] == ts) \
-        and (G.utilization_event.get(resource_name)[-1][-1] > 0):
+        and (G.utilization_event.get(resource_name)[-1][-1] > 0) \
+        and (G.utilization_event.get(resource_name)[-1][1] < G.resource_capacity[resource_name]):
         item = list(G.utilization_event.get(resource_name).pop(-1))
         item[1] += 1; item[2] -= 1 
         G.utilization_event.get(resource_name).append(tuple(item))
 
+def resample_monitor(data, grid):
+    """
+    Sample a change-point log of (timestamp, count, queue) onto a time grid,
+    as a polling process would have seen it: each grid point takes the
+    last state logged at or before it, and 0 before the first event.
+    Returns a list of (timestamp, count, queue) per grid point.
+    """
+    grid = asarray(grid, dtype=float)
+    if not data:
+        return [(t, 0, 0) for t in grid.tolist()]
+    ts, counts, queues = (asarray(column) for column in zip(*data))
+    idx = searchsorted(ts, grid, side='right') - 1
+    logged = idx >= 0
+    idx = where(logged, idx, 0)
+    return list(zip(grid.tolist(),
+                    where(logged, counts[idx], 0).tolist(),
+                    where(logged, queues[idx], 0).tolist()))
+
+def record(kind, key, value):
+    """
+    Log a sample, kind "queued" or "delta", to its sketch and,
+    if G.record_samples, to the full list in G.queued or G.delta.
+    """
+    G.sketches[kind + "/" + key].update(value)
+    samples = G.queued if kind == "queued" else G.delta
+    if G.record_samples and key in samples:
+        samples[key].append(value)
+
 class G:
     """
     Global variable values, including the following:
@@ -78,15 +108,30 @@ class G:
     mean_CT2triage = 5
     mean_CT2assessOPD = 60
     mean_CT2assessER = 30
+    share_OPD = 0.2         # Share of patients routed to outpatient care after triage
+
+    # Acuity-based triage: class 1 is most urgent. An empty mix keeps every queue FIFO.
+    acuity_mix = []                                 # Share of patients per acuity class, e.g. [0.1, 0.3, 0.6]
+    acuity_resources = ['doctorOPD', 'doctorER']    # Steps that serve patients in order of acuity
+    preemptive = False                              # Let a more urgent patient bump a less urgent one mid-assessment
+
+    # Overload handling. Defaults leave every run to the horizon and every patient in the queue.
+    screen_unstable = False # Skip, without simulating, scenarios with offered load rho >= 1 at any step
+    max_queue = None        # Stop a run early, flagged as diverged, once any queue holds more patients than this
+    balk_queue = {}         # Per step: a patient finding at least this many waiting walks away, e.g. {"doctorER": 20}
+    renege_patience = {}    # Per step: minutes a patient waits before walking away, e.g. {"doctorER": 240}
 
     # Information gathering
     arrival_ts = []         # Entity arrival times in a single run
     queued = {}             # Queueing times in a single run, step-wise (Use type of resource as key to extract data for that step)
     delta = {}              # Processing times in a single run, step-wise (Use type of resource as key to extract data for that step)
+    sketches = {}           # Streaming quantile sketches in a single run, keyed "queued/<step>", "delta/<step>" and "delta/TAT"
+    record_samples = True   # Keep every sample in queued and delta too; sketches alone keep memory bounded
 
     # Resource Monitoring
     utilization_event = {}  # Data from monkey-patched resource, single run
-    utilization_poll = {}   # Data from generator for polling resource stats, single run
+    utilization_poll = {}   # utilization_event resampled on a regular grid after the run, single run
+    poll_step = 0.25        # Grid resolution of utilization_poll in minutes
 
 class Patient:
     """
@@ -94,40 +139,142 @@ class Patient:
     """
     def __init__(self, patient_ID) -> None:
         self.ID = patient_ID
+        self.acuity = None      # Acuity class, assigned at triage
 
 class Process:
     """
     Process model including logic and resources
     """
-    def __init__(self) -> None:
-        self.env = simpy.Environment()
+    def __init__(self, streams=None, env=None) -> None:
+        self.env = env or simpy.Environment() # e.g. a simpy.rt.RealtimeEnvironment to run paced by the wall clock
         self.patient_counter = 0
+        self.monitored = False        # Resources patched to log to G.utilization_event
+        self.streams = streams or {}  # Random number stream per purpose, e.g. {"arrival": random.Random(1)}, module random if absent
+        self.preemptions = 0
+        self.balked = dict.fromkeys(G.resource_types, 0)
+        self.reneged = dict.fromkeys(G.resource_types, 0)
+        self.diverged = False
+        self._stop = self.env.event()   # Succeeds to end the run before the horizon
+        self._stop.callbacks.append(simpy.core.StopSimulation.callback)
         self.resources = {}
         for resource_type in G.resource_types:
-            self.resources[resource_type] = simpy.Resource(self.env, G.resource_capacity.get(resource_type))
+            resource_class = simpy.Resource
+            if G.acuity_mix and resource_type in G.acuity_resources:
+                resource_class = HeapPreemptiveResource if G.preemptive else HeapPriorityResource
+            self.resources[resource_type] = resource_class(self.env, G.resource_capacity.get(resource_type))
+
+    def rng(self, purpose):
+        """
+        Random number stream for one purpose: "arrival", "routing", "acuity" or a resource type.
+        Separate streams keep draws in step across runs, for common or antithetic random numbers.
+        """
+        return self.streams.get(purpose, random)
+
+    def request(self, resource_type, patient):
+        """
+        Request a resource, by the patient's acuity where the resource serves by acuity.
+        Ends the run as diverged if the queue now holds more than G.max_queue.
+        """
+        resource = self.resources[resource_type]
+        if isinstance(resource, simpy.PriorityResource):
+            req = resource.request(priority=patient.acuity, preempt=G.preemptive)
+        else:
+            req = resource.request()
+        if G.max_queue is not None and len(resource.queue) > G.max_queue and not self.diverged:
+            self.diverged = True
+            print("Queue for {} diverged at {:.2f}".format(resource_type, self.env.now)) if G.verbose else None
+            self._stop.succeed()
+        return req
+
+    def balks(self, resource_type, patient):
+        """
+        Whether the patient walks away on finding the queue at its G.balk_queue limit.
+        """
+        limit = G.balk_queue.get(resource_type)
+        if limit is None or len(self.resources[resource_type].queue) < limit:
+            return False
+        self.balked[resource_type] += 1
+        print("{} balked at {} at {:.2f}".format(patient.ID, resource_type, self.env.now)) if G.verbose else None
+        return True
+
+    def wait(self, resource_type, patient, req):
+        """
+        Wait until the request is granted, or until the patient runs out of
+        G.renege_patience for this step. Returns whether the patient was served.
+        """
+        patience = G.renege_patience.get(resource_type)
+        if patience is None:
+            yield req
+            return True
+        yield req | self.env.timeout(patience)
+        if req.triggered:
+            return True
+        self.reneged[resource_type] += 1
+        print("{} reneged at {} at {:.2f}".format(patient.ID, resource_type, self.env.now)) if G.verbose else None
+        return False
+
+    def hold(self, resource_type, patient, delta):
+        """
+        Hold the resource granted to the patient for delta. A patient bumped by a
+        more urgent one queues again and is served for the rest of delta.
+        """
+        started = self.env.now
+        try:
+            yield self.env.timeout(delta)
+        except simpy.Interrupt:
+            self.preemptions += 1
+            remaining = delta - (self.env.now - started)
+            print("{} (acuity {}) preempted at {:.2f} with {:.2f} to go".format(patient.ID, patient.acuity, self.env.now, remaining)) if G.verbose else None
+            with self.request(resource_type, patient) as req:
+                yield req
+                help_monitor(resource_type, self.env.now)
+                yield from self.hold(resource_type, patient, remaining)
 
     def monitor_capacity(self):
+        if self.monitored: # patching twice would log every change twice
+            return
+        self.monitored = True
         for resource_type in self.resources.keys():
             G.utilization_event[resource_type] = []
             mon_callback = get_monitor(G.utilization_event[resource_type])
             patch_resource(self.resources[resource_type], post=mon_callback)
     
-    def entity_generator(self):
+    @staticmethod
+    def clear_accumulators():
+        """
+        Empty the run data in G: arrivals, per-step sample lists and sketches.
+        """
         G.arrival_ts.clear()
         for resource_type in G.resource_types:
             G.queued[resource_type] = []
             G.delta[resource_type] = []
         G.delta["TAT"] = []  # Accounting for Turn-Around Time (TAT) per entity for end-end process
-        while True:
-            self.patient_counter += 1
-            patient = Patient(self.patient_counter)
+        G.sketches.clear()
+        for key in G.queued.keys():
+            G.sketches["queued/" + key] = KLL()
+        for key in G.delta.keys():
+            G.sketches["delta/" + key] = KLL()
+        for acuity in range(1, len(G.acuity_mix) + 1):
+            for resource_type in G.acuity_resources:
+                G.sketches["queued/{}/{}".format(resource_type, acuity)] = KLL()
+            G.sketches["delta/TAT/{}".format(acuity)] = KLL()
+
+    def admit(self):
+        """
+        A new patient arrives now and is sent onward.
+        """
+        self.patient_counter += 1
+        patient = Patient(self.patient_counter)
+        self.env.process(self.activity_generator(patient))
+        return patient
 
-            # Send patient onward 
-            action = self.activity_generator(patient)
-            self.env.process(action)
+    def entity_generator(self):
+        self.clear_accumulators()
+        while True:
+            self.admit()
 
             # Wait for next arrival
-            delta4arrival = random.expovariate(1.0 / G.mean_IAT)
+            delta4arrival = self.rng("arrival").expovariate(1.0 / G.mean_IAT)
             yield self.env.timeout(delta4arrival)
 
     def activity_generator(self, patient):      
@@ -136,70 +283,95 @@ class Process:
         print("{} arrived at {:.2f} [IAT {}]".format(patient.ID, arrived, G.mean_IAT)) if G.verbose else None
 
         # Request a receptionist for registration
-        with self.resources["receptionist"].request() as req_receptionist:
+        if self.balks("receptionist", patient):
+            return
+        with self.request("receptionist", patient) as req_receptionist:
             # Wait until receptionist is available
-            yield req_receptionist
+            if not (yield from self.wait("receptionist", patient, req_receptionist)):
+                return
 
             startedRegistration = self.env.now
             help_monitor('receptionist', startedRegistration)
-            G.queued["receptionist"].append(startedRegistration - arrived)
+            record("queued", "receptionist", startedRegistration - arrived)
             print("{} started registration at {:.2f} after waiting {:.2f} [#Receptionists {}]".format(patient.ID, startedRegistration, startedRegistration - arrived, G.resource_capacity["receptionist"])) if G.verbose else None
             
-            deltaRegistration = random.expovariate(1.0 / G.mean_CT2register)
-            G.delta["receptionist"].append(deltaRegistration)
+            deltaRegistration = self.rng("receptionist").expovariate(1.0 / G.mean_CT2register)
+            record("delta", "receptionist", deltaRegistration)
             yield self.env.timeout(deltaRegistration)
 
         arrived4triage = self.env.now
 
-        with self.resources["nurse"].request() as req_nurse:
+        if self.balks("nurse", patient):
+            return
+        with self.request("nurse", patient) as req_nurse:
             # Wait until nurse is available
-            yield req_nurse
+            if not (yield from self.wait("nurse", patient, req_nurse)):
+                return
             
             startedTriage = self.env.now
             help_monitor('nurse', startedTriage)
-            G.queued["nurse"].append(startedTriage - arrived4triage)
+            record("queued", "nurse", startedTriage - arrived4triage)
             print("{} started triage at {:.2f} after waiting {:.2f} [#Nurses {}]".format(patient.ID, startedTriage, startedTriage - arrived4triage, G.resource_capacity["nurse"])) if G.verbose else None
 
-            deltaTriage = random.expovariate(1.0 / G.mean_CT2triage)
-            G.delta["nurse"].append(deltaTriage)
+            deltaTriage = self.rng("nurse").expovariate(1.0 / G.mean_CT2triage)
+            record("delta", "nurse", deltaTriage)
             yield self.env.timeout(deltaTriage)
 
+            if G.acuity_mix:
+                patient.acuity = self.rng("acuity").choices(range(1, len(G.acuity_mix) + 1), weights=G.acuity_mix)[0]
+
         arrived4assessment = self.env.now
 
-        which_way = random.uniform(0, 1)
+        which_way = self.rng("routing").uniform(0, 1)
 
-        if (which_way < 0.2):
-            with self.resources["doctorOPD"].request() as req_doctorOPD:
+        if (which_way < G.share_OPD):
+            if self.balks("doctorOPD", patient):
+                return
+            with self.request("doctorOPD", patient) as req_doctorOPD:
                 # Wait until doctor is available in outpatient care
-                yield req_doctorOPD
+                if not (yield from self.wait("doctorOPD", patient, req_doctorOPD)):
+                    return
 
                 startedAssessmentOPD = self.env.now
                 help_monitor('doctorOPD', startedAssessmentOPD)
-                G.queued["doctorOPD"].append(startedAssessmentOPD - arrived4assessment)
+                record("queued", "doctorOPD", startedAssessmentOPD - arrived4assessment)
+                if patient.acuity and "doctorOPD" in G.acuity_resources:
+                    record("queued", "doctorOPD/{}".format(patient.acuity), startedAssessmentOPD - arrived4assessment)
                 print("{} started assessment in outpatient care at {:.2f} after waiting {:.2f} [#Doctors OPD {}]".format(patient.ID, startedAssessmentOPD, startedAssessmentOPD - arrived4assessment, G.resource_capacity["doctorOPD"])) if G.verbose else None          
 
-                deltaAssessmentOPD = random.expovariate(1.0 / G.mean_CT2assessOPD)
-                G.delta["doctorOPD"].append(deltaAssessmentOPD)
-                yield self.env.timeout(deltaAssessmentOPD)
+                deltaAssessmentOPD = self.rng("doctorOPD").expovariate(1.0 / G.mean_CT2assessOPD)
+                record("delta", "doctorOPD", deltaAssessmentOPD)
+                yield from self.hold("doctorOPD", patient, deltaAssessmentOPD)
         else:
-            with self.resources["doctorER"].request() as req_doctorER:
+            if self.balks("doctorER", patient):
+                return
+            with self.request("doctorER", patient) as req_doctorER:
             # Wait until doctor is available for inpatient care
-                yield req_doctorER
+                if not (yield from self.wait("doctorER", patient, req_doctorER)):
+                    return
 
                 startedAssessmentER = self.env.now
                 help_monitor('doctorER', startedAssessmentER)
-                G.queued["doctorER"].append(startedAssessmentER - arrived4assessment)
+                record("queued", "doctorER", startedAssessmentER - arrived4assessment)
+                if patient.acuity and "doctorER" in G.acuity_resources:
+                    record("queued", "doctorER/{}".format(patient.acuity), startedAssessmentER - arrived4assessment)
                 print("{} started asessment in inpatient care at {:.2f} after waiting {:.2f} [#Doctors ER {}]".format(patient.ID, startedAssessmentER, startedAssessmentER - arrived4assessment, G.resource_capacity["doctorER"])) if G.verbose else None
                 
-                deltaAssessmentER = random.expovariate(1.0 / G.mean_CT2assessER)
-                G.delta["doctorER"].append(deltaAssessmentER)
-                yield self.env.timeout(deltaAssessmentER)
+                deltaAssessmentER = self.rng("doctorER").expovariate(1.0 / G.mean_CT2assessER)
+                record("delta", "doctorER", deltaAssessmentER)
+                yield from self.hold("doctorER", patient, deltaAssessmentER)
 
                 exited = self.env.now    
-                G.delta["TAT"].append(exited - arrived)
+                record("delta", "TAT", exited - arrived)
+                if patient.acuity:
+                    record("delta", "TAT/{}".format(patient.acuity), exited - arrived)
                 print("{} HAD LEAD TIME OF {:.0f} MINUTES.".format(patient.ID,  exited - arrived)) if G.verbose else None
 
-    def run_once(self, proc_monitor=False):
+    def run_once(self, proc_monitor=False, arrivals=True):
+        """
+        Run to the horizon and summarize. With arrivals=False there are no
+        generated arrivals, only patients admitted by other processes.
+        """
         run_result = {
             "Queued": {},
             "Delta": {},
@@ -207,40 +379,196 @@ class Process:
         }
 
         # Make it so
+        self.monitor_capacity() # utilization is read off the change-point log, never another run's
         G_resource = G.utilization_event        
-        self.env.process(self.entity_generator())
-        if proc_monitor:
-            G_resource = G.utilization_poll
-            self.env.process(self.poll_capacity())
+        if arrivals:
+            self.env.process(self.entity_generator())
+        else:
+            self.clear_accumulators()
         self.env.run(until=G.simulation_horizon)
+        if proc_monitor: # Polled view rebuilt from the change points, no polling process needed
+            G_resource = G.utilization_poll
+            self.poll_capacity()
 
         for resource_type in G.resource_types:
-            run_result["Queued"][resource_type] = median(G.queued[resource_type]) 
-            run_result["Delta"][resource_type] = median(G.delta[resource_type])
+            run_result["Queued"][resource_type] = G.sketches["queued/" + resource_type].quantile(0.5)
+            run_result["Delta"][resource_type] = G.sketches["delta/" + resource_type].quantile(0.5)
+            if not G_resource[resource_type]: # Never requested, e.g. everyone balked upstream
+                run_result["Utilization"][resource_type] = 0.0
+                continue
             x, y, _ = list(zip(*G_resource[resource_type]))
             Nr = trapz(y, x)
             Dr = G.resource_capacity[resource_type] * x[-1]
             run_result["Utilization"][resource_type] = Nr / Dr
-        run_result["Delta"]["TAT"] = median(G.delta["TAT"])
+        run_result["Delta"]["TAT"] = G.sketches["delta/TAT"].quantile(0.5)
+        if G.acuity_mix:
+            run_result["Acuity"] = {"preemptions": self.preemptions}
+            for acuity in range(1, len(G.acuity_mix) + 1):
+                for resource_type in G.acuity_resources:
+                    key = "queued/{}/{}".format(resource_type, acuity)
+                    run_result["Acuity"][key] = G.sketches[key].quantile(0.5)
+                run_result["Acuity"]["delta/TAT/{}".format(acuity)] = G.sketches["delta/TAT/{}".format(acuity)].quantile(0.5)
+        if watches_overload():
+            run_result["Status"] = get_status(diverged=self.diverged, ended=self.env.now,
+                                              balked=self.balked, reneged=self.reneged)
         
         return run_result
    
-    def poll_capacity(self):
+    def poll_capacity(self, step=None):
         """
-        Generator for monitoring process that shares the environment with the main process
-        and collects information.
+        Fill G.utilization_poll with the resource stats every step minutes
+        (G.poll_step) up to now, resampled from G.utilization_event.
+        Call after the run, with the resources patched by monitor_capacity().
         """
+        if not self.monitored:
+            raise RuntimeError("poll_capacity needs the change-point log; call monitor_capacity() before the run")
+        grid = arange(0, self.env.now, step or G.poll_step)
         for resource_type in self.resources.keys():
-            G.utilization_poll[resource_type] = []
-        while True:
-            for k, v in self.resources.items():
-                item = (self.env.now,
-                        v.count,
-                        len(v.queue))
-                G.utilization_poll.get(k).append(item)
-            yield self.env.timeout(0.25)    
+            G.utilization_poll[resource_type] = resample_monitor(G.utilization_event.get(resource_type, []), grid)
+
+def watches_overload():
+    return G.screen_unstable or G.max_queue is not None or bool(G.balk_queue) or bool(G.renege_patience)
+
+def get_status(unstable=False, diverged=False, ended=None, balked=None, reneged=None):
+    """
+    Status block of a run result, numeric like the KPIs: 1.0 flags an unstable
+    (screened out) or diverged (stopped early) run; ended is the simulation time
+    the run stopped at; balked and reneged count patients per step.
+    """
+    status = {"unstable": float(unstable), "diverged": float(diverged),
+              "ended": float(G.simulation_horizon if ended is None else ended)}
+    for resource_type in G.resource_types:
+        status["balked/" + resource_type] = float((balked or {}).get(resource_type, 0))
+        status["reneged/" + resource_type] = float((reneged or {}).get(resource_type, 0))
+    return status
+
+def step_rates(scenario=None):
+    """
+    (arrival rate, mean service time, capacity) per step, for a scenario or,
+    by default, for the parameters in G.
+    """
+    params = resolve_scenario(scenario) if scenario is not None else get_scenario()
+    arrival_rate = 1.0 / params["mean_IAT"]
+    rates = {
+        "receptionist": (arrival_rate, params["mean_CT2register"]),
+        "nurse": (arrival_rate, params["mean_CT2triage"]),
+        "doctorOPD": (arrival_rate * params["share_OPD"], params["mean_CT2assessOPD"]),
+        "doctorER": (arrival_rate * (1 - params["share_OPD"]), params["mean_CT2assessER"])
+    }
+    return {resource_type: rates[resource_type] + (params["resource_capacity"][resource_type],)
+            for resource_type in G.resource_types}
+
+def offered_load(scenario=None):
+    """
+    Offered load rho = arrival rate x mean service time / capacity per step,
+    for a scenario or, by default, for the parameters in G. With rho >= 1 at
+    any step the queue there grows without bound.
+    """
+    return {resource_type: arrival_rate * mean_service / capacity
+            for resource_type, (arrival_rate, mean_service, capacity) in step_rates(scenario).items()}
+
+def is_unstable(scenario=None):
+    """
+    True if the offered load reaches rho >= 1 at some step, the test behind
+    screen_unstable and the analytic screen's "infeasible".
+    """
+    return max(offered_load(scenario).values()) >= 1
+
+def get_screened_result():
+    """
+    Run result of a scenario skipped as unstable: KPIs are NaN, G's run data
+    is empty, with the per-step lists in place as after a run without patients.
+    """
+    Process.clear_accumulators()
+    G.sketches.clear() # nothing to merge into sweep quantiles
+    G.utilization_event.clear()
+    G.utilization_event.update({resource_type: [] for resource_type in G.resource_types})
+    nan = float("nan")
+    return {
+        "Queued": dict.fromkeys(G.resource_types, nan),
+        "Delta": dict.fromkeys(G.resource_types + ["TAT"], nan),
+        "Utilization": dict.fromkeys(G.resource_types, nan),
+        "Status": get_status(unstable=True, ended=0.0)
+    }
+
+SCENARIO_KEYS = ['simulation_horizon', 'mean_IAT', 'mean_CT2register', 'mean_CT2triage',
+                 'mean_CT2assessOPD', 'mean_CT2assessER', 'share_OPD', 'resource_capacity',
+                 'acuity_mix', 'acuity_resources', 'preemptive', 'screen_unstable', 'max_queue', 'balk_queue', 'renege_patience']
+
+def get_scenario():
+    """
+    Snapshot of the model parameters held in G as a plain dict,
+    fit to be pickled to a worker process or dumped to JSON.
+    """
+    return {key: deepcopy(getattr(G, key)) for key in SCENARIO_KEYS}
+
+def apply_scenario(scenario):
+    """
+    Set the model parameters in G from a scenario dict.
+    Parameters missing from the scenario revert to their defaults, so that
+    scenarios run back-to-back in one process do not leak into each other.
+    The resource_capacity entry may be partial, e.g. {"doctorER": 3}.
+    A "name" entry is allowed for labelling and otherwise ignored.
+    """
+    full = resolve_scenario(scenario)
+    for key in SCENARIO_KEYS:
+        if key != "resource_capacity":
+            setattr(G, key, full[key])
+    G.resource_capacity.clear()
+    G.resource_capacity.update(full["resource_capacity"])
+
+def resolve_scenario(scenario):
+    """
+    Complete scenario dict, with defaults for the parameters it leaves out.
+    Leaves G alone.
+    """
+    unknown = set(scenario) - set(SCENARIO_KEYS) - {"name"}
+    if unknown:
+        raise ValueError("Unknown scenario parameters: {}".format(", ".join(sorted(unknown))))
+    full = {key: deepcopy(scenario.get(key, _DEFAULT_SCENARIO[key])) for key in SCENARIO_KEYS}
+    full["resource_capacity"] = dict(_DEFAULT_SCENARIO["resource_capacity"], **scenario.get("resource_capacity", {}))
+    return full
+
+def run_replication(scenario, seed=None, streams=None):
+    """
+    One independent simulation run of a scenario, self-contained so that it
+    can be shipped to a worker process: configure G, seed, run once.
+    With G.screen_unstable, an overloaded scenario is not run at all.
+    """
+    apply_scenario(scenario)
+    if G.screen_unstable and is_unstable():
+        return get_screened_result()
+    if seed is not None:
+        random.seed(seed)
+    p = Process(streams)
+    p.monitor_capacity()
+    return p.run_once()
+
+def run_sketched(scenario, seed=None, streams=None):
+    """
+    run_replication with sketches only, no full sample lists.
+    Returns the run result and the run's sketches, to merge across runs.
+    """
+    record_samples = G.record_samples
+    G.record_samples = False
+    try:
+        run_result = run_replication(scenario, seed, streams)
+    finally:
+        G.record_samples = record_samples
+    return run_result, dict(G.sketches)
+
+_DEFAULT_SCENARIO = get_scenario()
 
 def gggauge(pos, breaks=asarray([0, 30, 70, 100]), r_inner=0.5, r_outer=1.0):
+    """
+    Gauge chart for a percentage, e.g. resource utilization.
+    Plotting packages are imported here rather than at module level,
+    so that headless runs and pool workers never pay for them.
+    """
+    from plotnine import ggplot, geom_polygon, geom_text, annotate, aes, coord_fixed, \
+                         theme_bw, theme, element_blank
+    import pandas as pd
+
     def get_poly(a, b, r_inner=r_inner, r_outer=r_outer):
         
         theta_start = pi * (1 - a/100)
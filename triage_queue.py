@@ -0,0 +1,80 @@
+'''
+Priority resources whose wait queue is a binary heap.
+SimPy's PriorityResource and PreemptiveResource keep pending requests in a
+SortedQueue, a list re-sorted on every append. That is O(n) per request and
+crawls once an ER queue runs into the tens of thousands under surge loads.
+HeapQueue keeps the same ordering, by request key with ties first come
+first served, at O(log n) per append and pop. Cancellations, e.g. from
+reneging, are removed lazily when they reach the top.
+
+SimPy only needs append(), pop(), remove(), [] and len() of a put queue,
+and Resource only ever looks at the head, so the heap drops in as PutQueue.
+'''
+
+from heapq import heappop, heappush
+from itertools import count
+
+import simpy
+
+class HeapQueue:
+    """
+    Put queue of PriorityRequests, ordered by (request key, arrival sequence).
+    """
+    def __init__(self) -> None:
+        self._heap = []
+        self._live = set()  # ids of queued events not yet cancelled
+        self._sequence = count()
+
+    def append(self, event):
+        heappush(self._heap, (event.key, next(self._sequence), event))
+        self._live.add(id(event))
+
+    def remove(self, event):
+        """
+        Cancel a queued event; it stays in the heap until it reaches the top.
+        """
+        if id(event) not in self._live:
+            raise ValueError("event is not in the queue")
+        self._live.discard(id(event))
+
+    def pop(self, idx=0):
+        if idx != 0:
+            event = self[idx]
+            self.remove(event)
+            return event
+        self._prune()
+        if not self._heap:
+            raise IndexError("pop from empty queue")
+        event = heappop(self._heap)[2]
+        self._live.discard(id(event))
+        return event
+
+    def __getitem__(self, idx):
+        if idx != 0: # not used by SimPy's resources, hence no effort to be fast
+            return list(self)[idx]
+        self._prune()
+        if not self._heap:
+            raise IndexError("queue index out of range")
+        return self._heap[0][2]
+
+    def __len__(self):
+        return len(self._live)
+
+    def __iter__(self):
+        return iter([event for _, _, event in sorted(self._heap) if id(event) in self._live])
+
+    def _prune(self):
+        while self._heap and id(self._heap[0][2]) not in self._live:
+            heappop(self._heap)
+
+class HeapPriorityResource(simpy.PriorityResource):
+    """
+    PriorityResource with an O(log n) wait queue.
+    """
+    PutQueue = HeapQueue
+
+class HeapPreemptiveResource(simpy.PreemptiveResource):
+    """
+    PreemptiveResource with an O(log n) wait queue.
+    """
+    PutQueue = HeapQueue
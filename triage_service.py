@@ -0,0 +1,326 @@
+'''
+Local simulation service: one warm process pool shared by every dashboard
+and script on the machine, instead of each Streamlit session simulating in
+its own UI process.
+
+Clients POST a job, a scenario with a number of replications and an optional
+seed, and read back newline-delimited JSON events as replications finish:
+    {"job": ..., "event": "queued"}
+    {"job": ..., "event": "run", "index": 3, "result": {...}}      (one per replication)
+    {"job": ..., "event": "done", "result": {...}}                  (as one triage_cli result)
+    {"job": ..., "event": "error", "error": "..."}
+A scenario triage_cli.get_verdict skips, e.g. unstable with screen_unstable
+set, is done at once with a "skipped" result and no runs. NaN KPIs, from
+steps no patient reached, are sent as null.
+Jobs are keyed by the resolved scenario, number of runs and seed, so an
+identical request joins the job already queued, running or done and gets the
+same events replayed; it is computed once. Jobs run first come first served,
+replications fanned out over the pool as workers free up.
+
+Plain HTTP on asyncio streams, standard library only:
+    POST /jobs           body {"scenario": {...}, "number_runs": 30, "seed": 1}
+    GET  /jobs/<job id>  events of a known job, e.g. after a dropped connection
+    GET  /status         workers, queued and cached jobs
+
+Usage:
+    python triage_service.py --port 8765 --workers 4
+    for event in stream_job("127.0.0.1:8765", {"mean_IAT": 7}, number_runs=30): ...
+    result = run_remote("127.0.0.1:8765", {"mean_IAT": 7}, number_runs=30)
+Set TRIAGE_SERVICE=127.0.0.1:8765 to have StreamTriage.py use the service.
+'''
+
+import argparse
+import asyncio
+import hashlib
+import http.client
+import json
+import os
+import signal
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from triage_model import G, resolve_scenario, run_sketched
+from triage_cli import collect_results, get_skipped_result, get_verdict, strict_json
+from triage_distributed import compact_result, parse_address
+
+class Job:
+    """
+    One scenario x number_runs x seed, with the events published so far.
+    Subscribers replay the events from the start and then follow new ones.
+    """
+    def __init__(self, job_id, scenario, number_runs, seed=None) -> None:
+        self.id = job_id
+        self.scenario = scenario
+        self.number_runs = number_runs
+        self.seed = seed
+        self.events = []
+        self.finished = False
+        self.failed = False
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event, finished=False):
+        async with self._changed:
+            self.events.append(strict_json(dict(event, job=self.id)))
+            self.finished = self.finished or finished
+            self._changed.notify_all()
+
+    async def follow(self):
+        """
+        Async iterator over all events of the job, ending after the last one.
+        """
+        i = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: i < len(self.events) or self.finished)
+                events = self.events[i:]
+                finished = self.finished
+            for event in events:
+                yield event
+            i += len(events)
+            if finished and i == len(self.events):
+                return
+
+def get_job_id(scenario, number_runs, seed=None):
+    """
+    Same key for requests that would simulate the same thing, however the
+    scenario is spelled: parameters are resolved against the defaults first.
+    """
+    key = json.dumps([resolve_scenario(scenario), number_runs, seed], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+def get_job_request(body):
+    """
+    (scenario, number_runs, seed) from the body of POST /jobs.
+    Raises ValueError if it is not a job request.
+    """
+    request = json.loads(body or b"{}")
+    if not isinstance(request, dict):
+        raise ValueError("Request must be a JSON object")
+    scenario = request.get("scenario", {})
+    number_runs = request.get("number_runs", G.number_runs)
+    seed = request.get("seed")
+    if not isinstance(scenario, dict):
+        raise ValueError("scenario must be a JSON object")
+    if not isinstance(number_runs, int) or isinstance(number_runs, bool) or number_runs < 1:
+        raise ValueError("number_runs must be a positive integer")
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+        raise ValueError("seed must be an integer or null")
+    return scenario, number_runs, seed
+
+def _ping():
+    return os.getpid()
+
+class SimulationService:
+    """
+    Job queue and deduplication in front of a warm ProcessPoolExecutor.
+    At most workers replications are in flight, so a long job does not
+    flood the pool ahead of jobs queued after it.
+    """
+    def __init__(self, workers=None, cache_size=256) -> None:
+        self.workers = workers or os.cpu_count()
+        self.cache_size = cache_size
+        self.jobs = OrderedDict() # job_id -> Job, oldest first
+        self._queue = None
+        self._pool = None
+        self._slots = None
+        self._tasks = set() # strong references, the event loop only keeps weak ones
+
+    async def start(self):
+        """
+        Fork the workers up front and let each import the model once, so
+        the first job does not pay for process start-up.
+        """
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._pool, _ping) for _ in range(self.workers)])
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        self._dispatcher.cancel()
+        self._pool.shutdown(cancel_futures=True)
+
+    async def submit(self, scenario, number_runs, seed=None):
+        """
+        Job for the request: the existing one if an identical request was
+        seen before, otherwise a new job at the back of the queue.
+        """
+        job_id = get_job_id(scenario, number_runs, seed)
+        if job_id in self.jobs and not self.jobs[job_id].failed: # a failed job is retried afresh
+            self.jobs.move_to_end(job_id)
+            return self.jobs[job_id]
+        scenario = dict(scenario, name=scenario.get("name", job_id))
+        job = Job(job_id, scenario, number_runs, seed)
+        self.jobs.pop(job_id, None)
+        self.jobs[job_id] = job
+        self._evict()
+        await job.publish({"event": "queued"})
+        await self._queue.put(job)
+        return job
+
+    def status(self):
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize(),
+            "jobs": len(self.jobs),
+            "finished": sum(job.finished for job in self.jobs.values())
+        }
+
+    def _evict(self):
+        # Forget the least recently requested finished jobs beyond cache_size
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished]:
+            if len(self.jobs) <= self.cache_size:
+                return
+            del self.jobs[job_id]
+
+    async def _dispatch(self):
+        while True:
+            job = await self._queue.get()
+            runs = []
+            try:
+                verdict = get_verdict(job.scenario)
+                if verdict:
+                    await job.publish({"event": "done", "result": get_skipped_result(job.scenario, verdict)}, finished=True)
+                    continue
+                for i in range(job.number_runs):
+                    await self._slots.acquire()
+                    run = self._spawn(self._run(job, i))
+                    run.add_done_callback(lambda _: self._slots.release()) # also if cancelled before it started
+                    runs.append(run)
+            except Exception as e: # a bad job fails alone, the queue carries on
+                await self._fail(job, runs, e)
+                continue
+            self._spawn(self._finish(job, runs))
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, job, index):
+        seed = None if job.seed is None else job.seed + index
+        result, sketches = await asyncio.get_running_loop().run_in_executor(
+            self._pool, run_sketched, job.scenario, seed)
+        await job.publish({"event": "run", "index": index, "result": compact_result(result)})
+        return result, sketches
+
+    async def _finish(self, job, runs):
+        try:
+            run_results = await asyncio.gather(*runs)
+            result = collect_results([job.scenario], job.number_runs, list(run_results))[0]
+            await job.publish({"event": "done", "result": result}, finished=True)
+        except Exception as e:
+            await self._fail(job, runs, e)
+
+    async def _fail(self, job, runs, error):
+        for run in runs:
+            run.cancel()
+        job.failed = True
+        await job.publish({"event": "error", "error": repr(error)}, finished=True)
+
+    async def handle(self, reader, writer):
+        """
+        One HTTP request per connection; events are streamed as NDJSON
+        and the connection closes after the last one.
+        """
+        try:
+            method, path, _ = (await reader.readline()).decode().split(" ", 2)
+            headers = {}
+            while (line := (await reader.readline()).decode().strip()):
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            if method == "POST" and path == "/jobs":
+                job = await self.submit(*get_job_request(body))
+            elif method == "GET" and path.startswith("/jobs/") and path[len("/jobs/"):] in self.jobs:
+                job = self.jobs[path[len("/jobs/"):]]
+            elif method == "GET" and path == "/status":
+                await respond(writer, 200, json.dumps(self.status()))
+                return
+            else:
+                await respond(writer, 404, json.dumps({"error": "no such job or endpoint"}))
+                return
+
+            await respond(writer, 200)
+            async for event in job.follow():
+                writer.write((json.dumps(event) + "\n").encode())
+                await writer.drain()
+        except (ValueError, KeyError, TypeError, AttributeError, asyncio.IncompleteReadError) as e:
+            await respond(writer, 400, json.dumps({"error": repr(e)}))
+        except ConnectionError:
+            pass # client went away; the job carries on for anyone else
+        finally:
+            writer.close()
+
+async def respond(writer, code, body=None):
+    """
+    Status line and headers, then the body if given; streams follow the
+    headers with no Content-Length and end when the connection closes.
+    """
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}[code]
+    writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n"
+                 .format(code, reason).encode())
+    if body is not None:
+        writer.write((body + "\n").encode())
+    await writer.drain()
+
+async def serve(host="127.0.0.1", port=8765, workers=None, cache_size=256):
+    service = SimulationService(workers, cache_size)
+    await service.start()
+    server = await asyncio.start_server(service.handle, host, port)
+    for signum in (signal.SIGINT, signal.SIGTERM): # shut the pool down too, not just this process
+        asyncio.get_running_loop().add_signal_handler(signum, server.close)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await service.stop()
+
+def stream_job(address, scenario, number_runs=None, seed=None, timeout=None):
+    """
+    Submit a job to the service at "host:port" and yield its events as they arrive.
+    """
+    host, port = parse_address(address)
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        request = {"scenario": scenario, "number_runs": number_runs or G.number_runs, "seed": seed}
+        connection.request("POST", "/jobs", json.dumps(request), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        if response.status != 200:
+            raise RuntimeError("Service refused the job: {}".format(response.read().decode().strip()))
+        for line in response:
+            yield json.loads(line)
+    finally:
+        connection.close()
+
+def run_remote(address, scenario, number_runs=None, seed=None, on_run=None):
+    """
+    Run a job on the service and return its result, as one triage_cli result
+    without the sketches. on_run(index, result) is called per replication.
+    Raises RuntimeError if the job fails.
+    """
+    for event in stream_job(address, scenario, number_runs, seed):
+        if event["event"] == "run" and on_run:
+            on_run(event["index"], event["result"])
+        elif event["event"] == "done":
+            return event["result"]
+        elif event["event"] == "error":
+            raise RuntimeError("Job {} failed: {}".format(event["job"], event["error"]))
+    raise RuntimeError("Service closed the stream before the job finished")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve triage simulations from a warm process pool.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    parser.add_argument("--cache-size", type=int, default=256, help="finished jobs kept for identical requests")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.host, args.port, args.workers, args.cache_size))
+
+if __name__ == '__main__':
+    main()
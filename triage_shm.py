@@ -0,0 +1,125 @@
+'''
+Move per-entity arrays out of parallel runs through shared memory, not pickles.
+Each worker runs a replication, packs its raw samples (queue times and
+processing times per step, TAT, utilization_event traces) into one
+multiprocessing.shared_memory block as float64 arrays, and returns only a
+small descriptor: block name, array layout and the run_once KPIs.
+The parent maps the block, reads the arrays in place as NumPy views,
+reduces them and unlinks the block.
+
+Usage:
+    tasks = triage_cli.get_tasks(scenarios, number_runs, seed)
+    results = run_shared(tasks, jobs=4)                       # default reduce
+    results = run_shared(tasks, jobs=4, reduce=my_reduce)     # reduce(kpi, arrays)
+'''
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from triage_model import G, run_replication
+
+def get_samples():
+    """
+    Raw per-entity data of the last run in this process, keyed "queued/<step>",
+    "delta/<step>", "delta/TAT" and "utilization/<resource>" (rows of ts, count, queue).
+    """
+    samples = {}
+    for resource_type in G.resource_types:
+        samples["queued/" + resource_type] = G.queued[resource_type]
+        samples["delta/" + resource_type] = G.delta[resource_type]
+        samples["utilization/" + resource_type] = G.utilization_event.get(resource_type, [])
+    samples["delta/TAT"] = G.delta["TAT"]
+    return samples
+
+def write_shared(samples):
+    """
+    Copy arrays into a new shared memory block and return its descriptor,
+    {"name": ..., "layout": {key: (offset, shape)}}. The block outlives
+    this process; whoever reads it unlinks it.
+    """
+    arrays = {key: np.asarray(value, dtype=np.float64) for key, value in samples.items()}
+    layout, offset = {}, 0
+    for key, array in arrays.items():
+        layout[key] = (offset, array.shape)
+        offset += array.nbytes
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for key, array in arrays.items():
+        start, shape = layout[key]
+        np.ndarray(shape, dtype=np.float64, buffer=shm.buf, offset=start)[...] = array
+    shm.close()
+    return {"name": shm.name, "layout": layout}
+
+def run_to_shared(scenario, seed=None):
+    """
+    Worker side: one replication, samples to shared memory, descriptor back.
+    """
+    kpi = run_replication(scenario, seed)
+    descriptor = write_shared(get_samples())
+    descriptor["kpi"] = {kpi_name: {key: float(value) for key, value in values.items()}
+                         for kpi_name, values in kpi.items()}
+    return descriptor
+
+class SharedResult:
+    """
+    Parent side: map a block by descriptor and expose its arrays as
+    zero-copy views in .arrays. The views are only valid until close(),
+    which also unlinks the block; copy anything that must outlive it.
+    """
+    def __init__(self, descriptor) -> None:
+        self.kpi = descriptor.get("kpi")
+        self._shm = shared_memory.SharedMemory(name=descriptor["name"])
+        self.arrays = {key: np.ndarray(shape, dtype=np.float64, buffer=self._shm.buf, offset=offset)
+                       for key, (offset, shape) in descriptor["layout"].items()}
+
+    def close(self):
+        if self._shm is not None:
+            self.arrays = None # views must go before the buffer can be released
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def discard(descriptor):
+    SharedResult(descriptor).close()
+
+def summarize_samples(kpi, arrays, q=(50, 90, 99)):
+    """
+    Default reduce: the run_once KPIs plus percentiles of every sample array.
+    """
+    quantiles = {}
+    for key, array in arrays.items():
+        if not key.startswith("utilization/"):
+            quantiles[key] = [float(v) for v in np.percentile(array, q)] if array.size else [None] * len(q)
+    return {"kpi": kpi, "quantiles": quantiles}
+
+def run_shared(tasks, jobs=2, reduce=summarize_samples, worker=run_to_shared):
+    """
+    Run (scenario, seed) tasks on a process pool, reducing each run's arrays
+    in place with reduce(kpi, arrays) as it completes. Returns the reduced
+    values in task order. Blocks are unlinked even if a reduce fails.
+    worker(*task) may be any module-level function returning a descriptor
+    from write_shared, with its own small values under "kpi".
+    """
+    reduced = [None] * len(tasks)
+    # Workers must share the parent's resource tracker, else each worker's
+    # tracker would reclaim its blocks on exit, as leaks, before we unlink them.
+    resource_tracker.ensure_running()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(worker, *task) for task in tasks]
+        try:
+            for i, future in enumerate(futures):
+                with SharedResult(future.result()) as shared:
+                    reduced[i] = reduce(shared.kpi, shared.arrays)
+        except BaseException:
+            for future in futures[i + 1:]:
+                if not future.cancel() and future.exception() is None:
+                    discard(future.result())
+            raise
+    return reduced
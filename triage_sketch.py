@@ -0,0 +1,99 @@
+'''
+Mergeable streaming quantile sketch: KLL (Karnin, Lang and Liberty, 2016).
+Values go into a stack of compactors. Level h holds items that each stand
+for 2**h values. When the sketch outgrows its capacity, the lowest full
+level is sorted and every other item is promoted to the level above. Memory stays around 3k items
+however many values are added. Rank error is about 1.7/k in the worst case
+and less in practice. Sketches merge level by level, so per-run sketches
+from different replications or processes combine into one.
+
+Until the first compaction the sketch holds every value, and quantiles are
+exact, with numpy.percentile interpolation. A run_once median from a sketch
+is then the same as median() over the full list.
+'''
+
+from math import ceil
+
+from numpy import percentile
+
+class KLL:
+    """
+    Quantile sketch with update(x), merge(other) and quantile(q).
+    Compaction flips a coin from the sketch's own seeded generator, a 64-bit
+    LCG: sketching never shifts the simulation's random streams, and the same
+    values added or merged in the same order always give the same sketch,
+    however runs were spread over processes.
+    """
+    def __init__(self, k=128, seed=0) -> None:
+        self.k = k
+        self._state = seed
+        self.n = 0
+        self.levels = [[]]
+        self._size = 0
+        self._max_size = self._capacity(0)
+
+    def update(self, x):
+        self.levels[0].append(x)
+        self.n += 1
+        self._size += 1
+        if self._size >= self._max_size:
+            self._compress()
+
+    def merge(self, other):
+        """
+        Fold another sketch into this one, in place. Returns self.
+        """
+        while len(self.levels) < len(other.levels):
+            self._grow()
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.n += other.n
+        self._size += other._size
+        while self._size >= self._max_size:
+            self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+        Value at rank q (0..1) of everything added; NaN if empty.
+        """
+        if self.n == 0:
+            return float("nan")
+        if len(self.levels) == 1:
+            return float(percentile(self.levels[0], 100 * q))
+        items = sorted((x, 1 << h) for h, level in enumerate(self.levels) for x in level)
+        target = q * sum(weight for _, weight in items)
+        cumulative = 0
+        for x, weight in items:
+            cumulative += weight
+            if cumulative >= target:
+                return float(x)
+        return float(items[-1][0])
+
+    def quantiles(self, qs=(0.5, 0.9, 0.99)):
+        return {"p{:g}".format(100 * q): self.quantile(q) for q in qs}
+
+    def _capacity(self, h):
+        return ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - h)) + 1
+
+    def _grow(self):
+        self.levels.append([])
+        self._max_size = sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _flip(self):
+        self._state = (self._state * 6364136223846793005 + 1442695040888963407) % 2 ** 64
+        return self._state >> 63
+
+    def _compress(self):
+        # Compact the lowest full level: sort, promote every other item, keep one if odd
+        for h, level in enumerate(self.levels):
+            if len(level) >= self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self._grow()
+                level.sort()
+                keep = [level.pop()] if len(level) % 2 else []
+                promoted = level[self._flip()::2]
+                self.levels[h + 1].extend(promoted)
+                self.levels[h] = keep
+                self._size -= len(level) - len(promoted)
+                return
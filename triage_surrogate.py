@@ -0,0 +1,236 @@
+'''
+Surrogate metamodel for instant what-if answers.
+A Gaussian process, in plain NumPy, maps scenario parameters (mean_IAT, the
+mean service times, simulation_horizon, share_OPD and resource_capacity) to
+the KPI summary of a batch of replications, with a predictive standard
+deviation. WhatIf answers from the surrogate when it is confident, and
+otherwise runs and caches a real batch, which it adds to the training data.
+
+The other scenario parameters (acuity_mix, preemptive and the overload
+settings) are not smooth enough to interpolate over, so there is one
+surrogate per combination of them, and none until that combination has been
+simulated min_points times.
+
+Inputs are log-transformed and scaled to the training range, outputs
+standardized per KPI. One isotropic RBF kernel is shared by all KPIs, its
+length scale and noise chosen by marginal likelihood over a small grid.
+
+Usage:
+    what_if = WhatIf.load("surrogate.json")            # or WhatIf() to start cold
+    what_if = WhatIf(runner=lambda scenario, number_runs: run_remote(address, scenario, number_runs))
+    answer = what_if.query(get_scenario())             # {"kpi", "std", "source"}
+    answer = what_if.lookup(get_scenario())            # None unless cached or confident
+    what_if.learn(scenario, result["kpi"])             # a batch simulated elsewhere
+    what_if.save("surrogate.json")
+
+Seed it with sweep results from triage_cli: WhatIf(results=json.load(f)).
+'''
+
+import json
+import threading
+
+import numpy as np
+
+from triage_model import G, SCENARIO_KEYS, apply_scenario, get_scenario, resolve_scenario
+
+FEATURES = [key for key in SCENARIO_KEYS if key.startswith("mean_")] + ["simulation_horizon", "share_OPD"] + \
+           ["capacity/" + resource_type for resource_type in G.resource_types]
+LINEAR_FEATURES = ["share_OPD"]  # may be 0 or 1, so not log-transformed
+CONTEXT_KEYS = [key for key in SCENARIO_KEYS if key not in FEATURES and key != "resource_capacity"]
+LENGTH_SCALES = [0.1, 0.2, 0.5, 1.0, 2.0]
+NOISES = [1e-3, 1e-2, 0.03, 0.1, 0.3, 1.0]
+
+def get_features(scenario):
+    """
+    Feature vector of a scenario, filling unset parameters with defaults.
+    """
+    full = resolve_scenario(scenario)
+    values = [full["resource_capacity"][key.split("/")[1]] if key.startswith("capacity/") else full[key]
+              for key in FEATURES]
+    return np.array([value if key in LINEAR_FEATURES else np.log(value) for key, value in zip(FEATURES, values)])
+
+def get_context(scenario):
+    """
+    The parameters that are not features, as a key: scenarios only share
+    a surrogate if these are all the same.
+    """
+    full = resolve_scenario(scenario)
+    return json.dumps({key: full[key] for key in CONTEXT_KEYS}, sort_keys=True)
+
+def flatten_kpi(kpi):
+    return {"{}/{}".format(name, key): value for name, values in kpi.items() for key, value in values.items()}
+
+class Surrogate:
+    """
+    Multi-output Gaussian process regression on scenario features.
+    """
+    def __init__(self) -> None:
+        self.targets = None
+
+    def fit(self, X, Y, targets):
+        """
+        X: scenarios x features, Y: scenarios x targets (no NaN).
+        """
+        self.targets = targets
+        self._lo = X.min(axis=0)
+        span = X.max(axis=0) - self._lo
+        self._span = np.where(span > 0, span, 1.0)
+        self._mean = Y.mean(axis=0)
+        self._std = np.where(Y.std(axis=0) > 0, Y.std(axis=0), 1.0)
+        self._X = (X - self._lo) / self._span
+        Yn = (Y - self._mean) / self._std
+
+        best = None
+        for length_scale in LENGTH_SCALES:
+            for noise in NOISES:
+                K = self._kernel(self._X, self._X, length_scale) + noise * np.eye(len(X))
+                try:
+                    L = np.linalg.cholesky(K)
+                except np.linalg.LinAlgError:
+                    continue
+                alpha = np.linalg.solve(L.T, np.linalg.solve(L, Yn))
+                log_ml = -0.5 * (Yn * alpha).sum() - Yn.shape[1] * np.log(np.diag(L)).sum()
+                if best is None or log_ml > best[0]:
+                    best = (log_ml, length_scale, L, alpha)
+        _, self.length_scale, self._L, self._alpha = best
+        return self
+
+    def predict(self, x):
+        """
+        Mean and standard deviation per target at feature vector x; the standard
+        deviation is also returned in standardized units, comparable across targets.
+        """
+        xn = ((x - self._lo) / self._span)[None, :]
+        k = self._kernel(self._X, xn, self.length_scale)[:, 0]
+        v = np.linalg.solve(self._L, k)
+        std_norm = np.sqrt(max(1.0 - v @ v, 0.0))
+        mean = k @ self._alpha * self._std + self._mean
+        return mean, std_norm * self._std, std_norm
+
+    @staticmethod
+    def _kernel(A, B, length_scale):
+        d2 = ((A[:, None, :] - B[None, :, :]) ** 2).sum(axis=-1)
+        return np.exp(-0.5 * d2 / length_scale ** 2)
+
+def run_locally(scenario, number_runs):
+    """
+    Default WhatIf runner: triage_cli.run_scenarios, leaving G as it was.
+    """
+    from triage_cli import run_scenarios
+    current = get_scenario()
+    try:
+        return run_scenarios([scenario], number_runs)[0]
+    finally:
+        apply_scenario(current)
+
+class WhatIf:
+    """
+    Surrogate answers with a simulation fallback. A scenario whose predictive
+    std, in standardized units, exceeds tolerance is simulated with number_runs
+    replications instead; the result is cached and the surrogate refitted.
+    runner(scenario, number_runs) simulates and returns a triage_cli result,
+    by default run_scenarios in this process, e.g. run_remote on a service.
+    Scenarios are cached complete, so {} and get_scenario() hit the same entry.
+    """
+    def __init__(self, results=None, number_runs=30, tolerance=0.3, min_points=5, runner=None) -> None:
+        self.number_runs = number_runs
+        self.runner = runner or run_locally
+        self.tolerance = tolerance
+        self.min_points = min_points
+        self.cache = {}  # complete scenario as sorted JSON -> {"scenario", "kpi"}
+        self.surrogates = {}  # get_context() -> Surrogate
+        self._lock = threading.RLock()  # one WhatIf may serve several dashboard sessions
+        for result in results or []:
+            if not result.get("skipped"):
+                self.add(result["scenario"], result["kpi"])
+        self.refit()
+
+    def add(self, scenario, kpi):
+        """
+        Cache a simulated KPI summary. An empty one, e.g. from a scenario
+        the CLI skipped without simulating, is not training data.
+        """
+        if not kpi:
+            return
+        scenario = resolve_scenario(scenario)
+        with self._lock:
+            self.cache[json.dumps(scenario, sort_keys=True)] = {"scenario": scenario, "kpi": kpi}
+
+    def learn(self, scenario, kpi):
+        """
+        Add a KPI summary simulated elsewhere, e.g. by the dashboard, and refit.
+        """
+        with self._lock:
+            self.add(scenario, kpi)
+            self.refit()
+
+    def refit(self):
+        """
+        Fit one surrogate per context with at least min_points complete rows.
+        """
+        with self._lock:
+            contexts = {}
+            for entry in self.cache.values():
+                values = flatten_kpi(entry["kpi"]).values()
+                if values and not any(value is None or np.isnan(value) for value in values):
+                    contexts.setdefault(get_context(entry["scenario"]), []).append(entry)
+            surrogates = {}
+            for context, rows in contexts.items():
+                if len(rows) < self.min_points:
+                    continue
+                # KPIs reported by every scenario, e.g. Status only if all watch for overload
+                targets = [target for target in flatten_kpi(rows[0]["kpi"])
+                           if all(target in flatten_kpi(entry["kpi"]) for entry in rows)]
+                X = np.array([get_features(entry["scenario"]) for entry in rows])
+                Y = np.array([[flatten_kpi(entry["kpi"])[target] for target in targets] for entry in rows])
+                surrogates[context] = Surrogate().fit(X, Y, targets)
+            self.surrogates = surrogates
+
+    def lookup(self, scenario):
+        """
+        Answer from the cache or a confident surrogate, else None; never simulates.
+        """
+        return self._answer(resolve_scenario(scenario), confident=True)
+
+    def query(self, scenario, simulate=True):
+        """
+        {"kpi": {...}, "std": {...}, "source": "cache" | "surrogate" | "simulation"}.
+        With simulate=False, always answers from the context's surrogate if there is one.
+        Holds the lock while simulating, so that sessions asking the same
+        question wait for one simulation rather than each running their own.
+        """
+        scenario = resolve_scenario(scenario)
+        with self._lock:
+            answer = self._answer(scenario, confident=simulate)
+            if answer or not simulate:
+                return answer
+
+            result = self.runner(dict(scenario, name="what-if"), self.number_runs)
+            self.learn(scenario, result["kpi"])
+            return {"kpi": flatten_kpi(result["kpi"]), "std": None, "source": "simulation"}
+
+    def _answer(self, scenario, confident):
+        with self._lock:
+            key = json.dumps(scenario, sort_keys=True)
+            if key in self.cache:
+                return {"kpi": flatten_kpi(self.cache[key]["kpi"]), "std": None, "source": "cache"}
+            surrogate = self.surrogates.get(get_context(scenario))
+            if surrogate is None:
+                return None
+            mean, std, std_norm = surrogate.predict(get_features(scenario))
+            if confident and std_norm > self.tolerance:
+                return None
+            return {"kpi": dict(zip(surrogate.targets, mean.tolist())),
+                    "std": dict(zip(surrogate.targets, std.tolist())),
+                    "source": "surrogate"}
+
+    def save(self, path):
+        with self._lock:
+            entries = list(self.cache.values())
+        with open(path, 'w') as f:
+            json.dump(entries, f, indent=2)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path) as f:
+            return cls(results=json.load(f), **kwargs)
@@ -0,0 +1,194 @@
+'''
+Digital-twin mode: run a clinic day paced by the wall clock, sped up by a
+factor, and feed a live display. The model runs unchanged on a
+simpy.rt.RealtimeEnvironment, where one simulated minute takes
+60 / speed seconds. Arrivals can come from a local feed as well as, or
+instead of, the exponential arrival process.
+
+The environment is not strict: when events take longer to process than the
+pace allows, the simulation falls behind rather than failing. A ticker
+process measures by how much every tick minutes, and the run result gets a
+"Lag" block:
+- speed: simulated minutes per wall minute actually achieved, next to requested_speed
+- max_lag, mean_lag, p95_lag: seconds behind the requested pace
+- behind: share of ticks more than tolerance seconds behind
+Raise speed until behind stops being 0 to find what the hardware sustains.
+
+Feed: a text file, followed as it grows, or "-" for stdin. Each line is one
+arrival, or a JSON object {"count": n} for n arrivals at once. Feed arrivals
+are admitted at the next tick, so tick also sets the injection delay.
+
+Usage:
+    python triage_twin.py --speed 120 --feed arrivals.txt --no-arrivals --display
+    echo '{"count": 3}' >> arrivals.txt
+'''
+
+import argparse
+import json
+import queue
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+import simpy
+import simpy.rt
+
+from triage_model import Process, apply_scenario
+
+class Feed:
+    """
+    Arrivals read on a side thread from a file or stdin, counted until the
+    simulation drains them.
+    """
+    def __init__(self, path, follow=True, poll_interval=0.1) -> None:
+        self.path = path
+        self.follow = follow and path != "-"
+        self.poll_interval = poll_interval
+        self._arrivals = queue.Queue()
+        self._closed = threading.Event()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+
+    def start(self):
+        self._reader.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+
+    def drain(self):
+        """
+        Number of arrivals received since the last call.
+        """
+        count = 0
+        while True:
+            try:
+                count += self._arrivals.get_nowait()
+            except queue.Empty:
+                return count
+
+    def _read(self):
+        f = sys.stdin if self.path == "-" else open(self.path)
+        try:
+            while not self._closed.is_set():
+                line = f.readline()
+                if not line: # end of what has been written so far
+                    if not self.follow:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+                if line.strip():
+                    self._arrivals.put(parse_arrivals(line))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def parse_arrivals(line):
+    try:
+        entry = json.loads(line)
+    except ValueError:
+        return 1
+    return int(entry.get("count", 1)) if isinstance(entry, dict) else 1
+
+class Twin:
+    """
+    One realtime run of the model with lag measurement, feed injection
+    and a snapshot per tick for a display, on_tick(snapshot).
+    """
+    def __init__(self, speed=60.0, feed=None, arrivals=True, tick=0.25, tolerance=1.0, on_tick=None) -> None:
+        self.speed = speed
+        self.factor = 60.0 / speed   # wall seconds per simulated minute
+        self.feed = feed
+        self.arrivals = arrivals
+        self.tick = tick
+        self.tolerance = tolerance
+        self.on_tick = on_tick
+        self.lags = []
+        self.injected = 0
+
+    def run(self, scenario=None, seed=None):
+        if scenario is not None:
+            apply_scenario(scenario)
+        if seed is not None:
+            random.seed(seed)
+        env = simpy.rt.RealtimeEnvironment(factor=self.factor, strict=False)
+        p = Process(env=env)
+        p.monitor_capacity()
+        env.process(self.ticker(p))
+        if self.feed:
+            self.feed.start()
+        try:
+            env.sync() # the wall clock starts now, not when the environment was made
+            started = time.monotonic()
+            run_result = p.run_once(arrivals=self.arrivals)
+            elapsed = time.monotonic() - started
+        finally:
+            if self.feed:
+                self.feed.close()
+        run_result["Lag"] = self.lag_report(env.now, elapsed)
+        return run_result
+
+    def ticker(self, p):
+        """
+        Every tick: admit feed arrivals, measure the lag, update the display.
+        """
+        env = p.env
+        while True:
+            lag = max(0.0, time.monotonic() - env.real_start - (env.now - env.env_start) * self.factor)
+            self.lags.append(lag)
+            if self.feed:
+                for _ in range(self.feed.drain()):
+                    p.admit()
+                    self.injected += 1
+            if self.on_tick:
+                self.on_tick(get_snapshot(p, lag, self.injected))
+            yield env.timeout(self.tick)
+
+    def lag_report(self, now, elapsed):
+        lags = np.array(self.lags) if self.lags else np.zeros(1)
+        return {
+            "requested_speed": self.speed,
+            "speed": 60.0 * now / elapsed if elapsed > 0 else float("nan"),
+            "max_lag": float(lags.max()),
+            "mean_lag": float(lags.mean()),
+            "p95_lag": float(np.percentile(lags, 95)),
+            "behind": float((lags > self.tolerance).mean()),
+            "injected": float(self.injected)
+        }
+
+def get_snapshot(p, lag, injected=0):
+    """
+    State of the clinic now, for a display.
+    """
+    return {
+        "t": p.env.now,
+        "lag": lag,
+        "arrivals": p.patient_counter,
+        "injected": injected,
+        "busy": {resource_type: resource.count for resource_type, resource in p.resources.items()},
+        "queue": {resource_type: len(resource.queue) for resource_type, resource in p.resources.items()}
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a triage day paced by the wall clock, sped up.")
+    parser.add_argument("--speed", type=float, default=60.0, help="simulated minutes per wall minute")
+    parser.add_argument("--horizon", type=float, help="minutes to simulate (default: G.simulation_horizon)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--feed", help="arrival feed, a file followed as it grows or - for stdin")
+    parser.add_argument("--no-arrivals", action="store_true", help="feed arrivals only, no generated ones")
+    parser.add_argument("--tick", type=float, default=0.25, help="minutes between lag samples, feed reads and snapshots")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="seconds of lag that count as behind")
+    parser.add_argument("--display", action="store_true", help="print a JSON snapshot per tick")
+    args = parser.parse_args(argv)
+
+    scenario = {"simulation_horizon": args.horizon} if args.horizon else None
+    on_tick = (lambda snapshot: print(json.dumps(snapshot), flush=True)) if args.display else None
+    twin = Twin(args.speed, Feed(args.feed) if args.feed else None, not args.no_arrivals,
+                args.tick, args.tolerance, on_tick)
+    run_result = twin.run(scenario, args.seed)
+    print(json.dumps({kpi: {key: float(value) for key, value in values.items()}
+                      for kpi, values in run_result.items()}))
+
+if __name__ == '__main__':
+    main()
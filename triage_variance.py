@@ -0,0 +1,142 @@
+'''
+Variance reduction for replication KPIs: antithetic variates and control variates.
+Both report the plain estimate next to the reduced one, with the
+variance-reduction ratio (VRR): how many times fewer runs the reduced
+estimator needs for the same confidence as plain replication.
+
+- Antithetic: runs come in pairs driven by uniforms U and 1 - U, one stream
+  per purpose (arrivals, routing, each step), so that a long service in one
+  run meets a short one in its twin. The estimate is the mean of pair averages.
+- Control variates: the realized mean inter-arrival time and mean service
+  time per step have known expectations (G.mean_IAT, G.mean_CT2...). Runs
+  that drew unluckily long services are corrected by regression on them.
+- Both: control variates regressed on antithetic pair averages.
+
+Usage:
+    report = estimate({"mean_IAT": 7}, number_runs=20, seed=1, method="control")
+    report["Delta/TAT"]["control"]["vrr"]
+'''
+
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from triage_model import G, apply_scenario, run_replication
+
+STREAM_PURPOSES = ["arrival", "routing", "acuity"] + G.resource_types
+CONTROL_MEANS = {
+    "arrival": "mean_IAT",
+    "receptionist": "mean_CT2register",
+    "nurse": "mean_CT2triage",
+    "doctorOPD": "mean_CT2assessOPD",
+    "doctorER": "mean_CT2assessER"
+}
+METHODS = ["antithetic", "control", "antithetic+control"]
+Z95 = 1.96
+
+class AntitheticRandom(random.Random):
+    """
+    Random stream that draws 1 - U wherever the seed-twin draws U.
+    Zero maps to zero, keeping draws in [0, 1) as expovariate requires.
+    """
+    def random(self):
+        u = super().random()
+        return 1.0 - u if u else 0.0
+
+def make_streams(seed, antithetic=False):
+    """
+    One stream per purpose for Process(streams), seeded from seed and purpose.
+    """
+    stream_class = AntitheticRandom if antithetic else random.Random
+    return {purpose: stream_class("{}/{}".format(seed, purpose)) for purpose in STREAM_PURPOSES}
+
+def run_with_controls(scenario, seed, antithetic=False):
+    """
+    One replication; returns flat KPIs {"Queued/nurse": ..., "Delta/TAT": ...}
+    and realized control means {"arrival": ..., "nurse": ...}.
+    """
+    run_result = run_replication(scenario, streams=make_streams(seed, antithetic))
+    responses = {}
+    for kpi, values in run_result.items():
+        if kpi == "Status":
+            continue
+        for key, value in values.items():
+            if kpi != "Delta" or key == "TAT":
+                responses["{}/{}".format(kpi, key)] = float(value)
+    controls = {"arrival": float(np.mean(np.diff(G.arrival_ts))) if len(G.arrival_ts) > 1 else np.nan}
+    for resource_type in G.resource_types:
+        controls[resource_type] = float(np.mean(G.delta[resource_type])) if G.delta[resource_type] else np.nan
+    return responses, controls
+
+def get_control_means(scenario):
+    apply_scenario(scenario)
+    return np.array([getattr(G, CONTROL_MEANS[name]) for name in CONTROL_MEANS], dtype=float)
+
+def plain_estimate(y):
+    se = y.std(ddof=1) / np.sqrt(len(y))
+    return summarize(y.mean(), se, len(y))
+
+def control_estimate(y, C, mu):
+    """
+    Y - beta (C - mu) with beta fitted by least squares on the same runs.
+    """
+    n, q = C.shape
+    if n <= q + 1:
+        raise ValueError("Control variates need more than {} runs, got {}".format(q + 1, n))
+    C_centered = C - C.mean(axis=0)
+    beta, *_ = np.linalg.lstsq(C_centered, y - y.mean(), rcond=None)
+    residuals = y - y.mean() - C_centered @ beta
+    se = np.sqrt((residuals ** 2).sum() / (n - q - 1) / n)
+    return summarize(y.mean() - (C.mean(axis=0) - mu) @ beta, se, n)
+
+def get_vrr(plain_se, reduced_se):
+    """
+    Variance-reduction ratio; NaN when there was no variance to reduce,
+    e.g. a KPI that is 0 in every run, inf only for a genuine drop to 0.
+    """
+    if plain_se == 0:
+        return float("nan")
+    return plain_se ** 2 / reduced_se ** 2 if reduced_se > 0 else float("inf")
+
+def summarize(mean, se, n):
+    return {"mean": float(mean), "se": float(se), "ci": [float(mean - Z95 * se), float(mean + Z95 * se)], "n": int(n)}
+
+def estimate(scenario, number_runs=30, seed=0, method="control", jobs=1):
+    """
+    Plain and variance-reduced estimates of every KPI for a scenario,
+    from number_runs replications (antithetic methods: number_runs // 2 pairs).
+    Returns {kpi: {"plain": {...}, method: {..., "vrr": ...}}}.
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of {}".format(", ".join(METHODS)))
+    antithetic = method.startswith("antithetic")
+    if antithetic:
+        tasks = [(scenario, seed + i, twin) for i in range(number_runs // 2) for twin in (False, True)]
+    else:
+        tasks = [(scenario, seed + i, False) for i in range(number_runs)]
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            runs = list(pool.map(run_with_controls, *zip(*tasks)))
+    else:
+        runs = [run_with_controls(*task) for task in tasks]
+
+    mu = get_control_means(scenario)
+    C_all = np.array([[controls[name] for name in CONTROL_MEANS] for _, controls in runs])
+    report = {}
+    for kpi in runs[0][0].keys():
+        y_all = np.array([responses[kpi] for responses, _ in runs])
+        if antithetic: # estimate on pair averages, dropping pairs with a missing value
+            y = y_all.reshape(-1, 2).mean(axis=1)
+            C = C_all.reshape(-1, 2, C_all.shape[1]).mean(axis=1)
+            keep = ~np.isnan(y) & ~np.isnan(C).any(axis=1)
+            y_runs = y_all.reshape(-1, 2)[keep].ravel()
+        else:
+            y, C = y_all, C_all
+            keep = ~np.isnan(y) & ~np.isnan(C).any(axis=1)
+            y_runs = y[keep]
+        plain = plain_estimate(y_runs)
+        reduced = plain_estimate(y[keep]) if method == "antithetic" else control_estimate(y[keep], C[keep], mu)
+        reduced["vrr"] = get_vrr(plain["se"], reduced["se"])
+        report[kpi] = {"plain": plain, method: reduced}
+    return report